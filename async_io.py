@@ -0,0 +1,88 @@
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 為選用依賴，未安裝時改用同步流程
+    aiohttp = None
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def _run_in_context(context, coro):
+    """在指定的 context 中建立 task (Task 會複製建立當下的 context)，取消時一併取消"""
+    return await context.run(asyncio.ensure_future, coro)
+
+
+class AsyncRuntime:
+    """在背景執行緒中維持一個常駐的事件迴圈與共用的 aiohttp session
+
+    Cloud Functions 的實例會在多次請求間重複使用，因此事件迴圈和連線池只建立一次，
+    同步的 webhook 透過 run() 將協程交給背景迴圈執行並等待結果。
+    """
+
+    def __init__(self, enabled=None, timeout=None, connection_limit=None):
+        if enabled is None:
+            enabled = os.environ.get('ASYNC_IO', 'true').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled and aiohttp is not None
+        if timeout is None:
+            timeout = float(os.environ.get('HTTP_TIMEOUT', '10'))
+        self.timeout = timeout
+        if connection_limit is None:
+            connection_limit = int(os.environ.get('HTTP_CONNECTION_LIMIT', '20'))
+        self.connection_limit = connection_limit
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        """第一次使用時才啟動背景事件迴圈"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='async-io', daemon=True)
+                self._thread.start()
+                logger.info("Started async I/O event loop")
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """在背景迴圈中執行協程，阻塞直到完成並返回結果
+
+        呼叫端的 contextvars (例如 OpenTelemetry 目前的 span) 會傳遞給協程，
+        協程中的 asyncio.to_thread 也會再傳給工作執行緒。
+        """
+        context = contextvars.copy_context()
+        future = asyncio.run_coroutine_threadsafe(_run_in_context(context, coro), self._ensure_loop())
+        return future.result(timeout)
+
+    async def get_session(self):
+        """返回共用的 aiohttp session (只能在背景迴圈中呼叫)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.connection_limit),
+            )
+        return self._session
+
+    def close(self):
+        """關閉 session 並停止背景迴圈"""
+        if self._loop is None:
+            return
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+
+# 全域實例
+runtime = AsyncRuntime()
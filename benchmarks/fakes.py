@@ -0,0 +1,346 @@
+"""基準測試用的本地替身：RSS / LINE HTTP 伺服器、Gemini、NL API 與記憶體版 Firestore"""
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore import Increment
+
+
+class FaultInjector:
+    """依設定的延遲與錯誤率模擬外部服務"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def __call__(self):
+        """等待延遲時間，並依錯誤率決定是否失敗"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self.random.random() < self.error_rate
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data else None
+
+
+def _apply(existing, data):
+    """合併欄位並套用 Increment 轉換"""
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            value = existing.get(key, 0) + value.value
+        existing[key] = value
+    return existing
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _store(self):
+        return self._collection._docs
+
+    def get(self):
+        self._collection._client._record('get')
+        return FakeDocumentSnapshot(self, self._store.get(self.id))
+
+    def create(self, data):
+        self._collection._client._record('create')
+        with self._collection._client._lock:
+            if self.id in self._store:
+                raise AlreadyExists(f"Document already exists: {self.id}")
+            self._store[self.id] = _apply({}, data)
+
+    def set(self, data, merge=False):
+        self._collection._client._record('set')
+        if merge and self.id in self._store:
+            _apply(self._store[self.id], data)
+        else:
+            self._store[self.id] = _apply({}, data)
+
+    def update(self, data):
+        self._collection._client._record('update')
+        if self.id not in self._store:
+            raise KeyError(f"No document to update: {self.id}")
+        _apply(self._store[self.id], data)
+
+    def delete(self):
+        self._collection._client._record('delete')
+        self._store.pop(self.id, None)
+
+    def collection(self, name):
+        return self._collection._client.collection(f"{self._collection.name}/{self.id}/{name}")
+
+
+_OPERATORS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '>=': lambda a, b: a >= b,
+    '>': lambda a, b: a > b,
+    'in': lambda a, b: a in b,
+}
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), limit=None, order=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._limit = limit
+        self._order = order
+
+    def where(self, field, op, value):
+        return FakeQuery(self._collection, self._filters + [(field, op, value)], self._limit, self._order)
+
+    def order_by(self, field, direction='ASCENDING'):
+        return FakeQuery(self._collection, self._filters, self._limit, (field, direction))
+
+    def limit(self, count):
+        return FakeQuery(self._collection, self._filters, count, self._order)
+
+    def stream(self):
+        self._collection._client._record('query')
+        results = []
+        for doc_id, data in list(self._collection._docs.items()):
+            if all(field in data and _OPERATORS[op](data[field], value)
+                   for field, op, value in self._filters):
+                results.append(FakeDocumentSnapshot(self._collection.document(doc_id), data))
+        if self._order:
+            field, direction = self._order
+            results.sort(key=lambda doc: doc.get(field), reverse=direction == 'DESCENDING')
+        if self._limit is not None:
+            results = results[:self._limit]
+        return iter(results)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self._docs = client._data.setdefault(name, {})
+        super().__init__(self)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference, data):
+        self._ops.append(lambda: reference.update(data))
+
+    def delete(self, reference):
+        self._ops.append(reference.delete)
+
+    def commit(self):
+        for op in self._ops:
+            op()
+        self._ops = []
+
+
+class FakeFirestore:
+    """單執行緒、記憶體內的 Firestore 替身，並記錄每種操作的次數"""
+
+    def __init__(self, *args, **kwargs):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.operations = {}
+
+    def _record(self, op):
+        with self._lock:
+            self.operations[op] = self.operations.get(op, 0) + 1
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def reset_operations(self):
+        self.operations = {}
+
+
+# ---------------------------------------------------------------------------
+# Gemini / Natural Language API
+# ---------------------------------------------------------------------------
+
+class FakeGeminiModel:
+    """模擬 genai.GenerativeModel.generate_content"""
+
+    def __init__(self, fault):
+        self.fault = fault
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.fault():
+            raise RuntimeError("Simulated Gemini error")
+        if 'JSON' in prompt:
+            text = json.dumps({'ORGANIZATION': ['Acme'], 'PERSON': ['Jane Doe']})
+        elif any('\u4e00' <= char <= '\u9fff' for char in prompt[:50]):
+            text = '這是一段由替身模型產生的中文摘要，內容僅供基準測試使用。' * 3
+        else:
+            text = 'This is a stand-in summary produced for benchmarking purposes. ' * 4
+        return SimpleNamespace(text=text)
+
+
+class FakeLanguageClient:
+    """模擬 language_v1.LanguageServiceClient"""
+
+    def __init__(self, fault):
+        self.fault = fault
+
+    def detect_language(self, document=None, **kwargs):
+        if self.fault():
+            raise RuntimeError("Simulated NL API error")
+        return SimpleNamespace(languages=[SimpleNamespace(language_code='en')])
+
+    def analyze_entities(self, document=None, **kwargs):
+        if self.fault():
+            raise RuntimeError("Simulated NL API error")
+        return SimpleNamespace(entities=[])
+
+
+# ---------------------------------------------------------------------------
+# RSS 與 LINE API HTTP 伺服器
+# ---------------------------------------------------------------------------
+
+def build_rss(title, entries=20, chinese=False, now=None):
+    """產生 RSS 內容：前半為 now 起每分鐘一篇的新文章，後半為過期文章"""
+    now = (now or datetime.now(timezone.utc)).replace(microsecond=0)
+    items = []
+    for i in range(entries):
+        if i < entries // 2:
+            published_at = now - timedelta(minutes=i)
+        else:
+            published_at = datetime(2001, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i)
+        published = format_datetime(published_at)
+        # 同一時間發布的文章連結相同，模擬真實來源中每篇文章有固定網址
+        slug = int(published_at.timestamp())
+        if chinese:
+            summary = '台灣半導體產業持續成長，廠商宣布擴大投資。' * 8
+        else:
+            summary = 'The company announced a new product line and expanded investment. ' * 8
+        items.append(f"""<item>
+<title>{title} article {slug}</title>
+<link>https://example.com/{title}/{slug}</link>
+<description>{summary}</description>
+<pubDate>{published}</pubDate>
+</item>""")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>{title}</title>
+{''.join(items)}
+</channel></rss>""".encode('utf-8')
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'BenchStandIn/1.0'
+    # 與真實的 LINE API 及 RSS 來源一樣支援 keep-alive，連線池才能重複使用連線
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        feeds = self.server.feeds
+        name = self.path.lstrip('/').split('?')[0]
+        if name.startswith('rss/') and name[4:] in feeds:
+            if self.server.rss_fault():
+                self._reply(503, b'unavailable', 'text/plain')
+                return
+            # 每次請求都把時間往後推一分鐘，模擬來源持續有新文章
+            with self.server.lock:
+                self.server.rss_requests += 1
+                now = self.server.started_at + timedelta(minutes=self.server.rss_requests)
+            self._reply(200, build_rss(name[4:], now=now, **feeds[name[4:]]), 'application/rss+xml')
+        else:
+            self._reply(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.path.startswith('/v2/bot/message/'):
+            self.server.line_requests += 1
+            if self.server.line_fault():
+                self._reply(500, b'{"message":"Simulated LINE error"}')
+                return
+            self._reply(200, b'{}')
+        else:
+            self._reply(404, b'{}')
+
+
+class StandInServer:
+    """在背景執行緒提供 canned RSS feed 與假的 LINE Messaging API"""
+
+    def __init__(self, rss_fault=None, line_fault=None):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.feeds = {
+            'tech': {},
+            'tech_backup': {'chinese': True},
+            'business': {'chinese': True},
+            'business_backup': {},
+        }
+        self.httpd.lock = threading.Lock()
+        self.httpd.started_at = datetime.now(timezone.utc)
+        self.httpd.rss_requests = 0
+        self.httpd.rss_fault = rss_fault or FaultInjector()
+        self.httpd.line_fault = line_fault or FaultInjector()
+        self.httpd.line_requests = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def feed_url(self, name):
+        return f"{self.url}/rss/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,299 @@
+"""端對端基準測試：以本地替身驅動 webhook 的各個路由，回報延遲百分位數、吞吐量與記憶體
+
+用法：
+    python benchmarks/run_benchmarks.py                      # 執行並與 baseline.json 比較
+    python benchmarks/run_benchmarks.py --update-baseline    # 以本次結果更新基準
+    python benchmarks/run_benchmarks.py --gemini-latency 0.3 --gemini-error-rate 0.2
+
+若設定了 FIRESTORE_EMULATOR_HOST，會改用 Firestore 模擬器而非記憶體版替身。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack, redirect_stdout
+from datetime import datetime, timedelta
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import (  # noqa: E402
+    FakeFirestore, FakeGeminiModel, FakeLanguageClient, FaultInjector, StandInServer
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+CHANNEL_SECRET = 'bench-channel-secret'
+CHANNEL_TOKEN = 'bench-channel-token'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark for news_linebot')
+    parser.add_argument('--iterations', type=int, default=20, help='每個情境的執行次數')
+    parser.add_argument('--subscribers', type=int, default=5, help='預先建立的訂閱者數量')
+    parser.add_argument('--callback-events', type=int, default=10, help='每次 /callback 的訊息事件數')
+    parser.add_argument('--replay-events', type=int, default=200, help='message_replay 每次處理的訊息數')
+    parser.add_argument('--expired-records', type=int, default=50, help='每次 /cleanup 前建立的過期紀錄數')
+    parser.add_argument('--gemini-latency', type=float, default=0.0)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--nl-latency', type=float, default=0.0)
+    parser.add_argument('--nl-error-rate', type=float, default=0.0)
+    parser.add_argument('--rss-latency', type=float, default=0.0)
+    parser.add_argument('--rss-error-rate', type=float, default=0.0)
+    parser.add_argument('--line-latency', type=float, default=0.0)
+    parser.add_argument('--line-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--scenarios', default='send_tech_news,send_business_news,cleanup,callback,message_replay')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允許的退步比例 (0.25 = 25%%)')
+    parser.add_argument('--verbose', action='store_true', help='顯示應用程式的日誌與輸出')
+    return parser.parse_args()
+
+
+def install_stand_ins(stack, args, server, db):
+    """在匯入應用程式模組前替換外部服務客戶端"""
+    from google.cloud import firestore, language_v1
+    import google.generativeai as genai
+
+    os.environ['LINE_CHANNEL_SECRET'] = CHANNEL_SECRET
+    os.environ['LINE_CHANNEL_ACCESS_TOKEN'] = CHANNEL_TOKEN
+    os.environ['GEMINI_API_KEY'] = 'bench-gemini-key'
+
+    gemini_fault = FaultInjector(args.gemini_latency, args.gemini_error_rate, args.seed)
+    nl_fault = FaultInjector(args.nl_latency, args.nl_error_rate, args.seed)
+
+    if db is not None:
+        stack.enter_context(mock.patch.object(firestore, 'Client', lambda *a, **k: db))
+    stack.enter_context(mock.patch.object(language_v1, 'LanguageServiceClient',
+                                          lambda *a, **k: FakeLanguageClient(nl_fault)))
+    stack.enter_context(mock.patch.object(genai, 'configure', lambda **k: None))
+    stack.enter_context(mock.patch.object(genai, 'GenerativeModel',
+                                          lambda *a, **k: FakeGeminiModel(gemini_fault)))
+
+    import main
+    from linebot import LineBotApi
+    from source_registry import SourceRegistry
+
+    # LINE API 與 RSS 來源改指向本地伺服器
+    stack.enter_context(mock.patch.object(main, 'line_bot_api',
+                                          LineBotApi(CHANNEL_TOKEN, endpoint=server.url)))
+
+    registry = SourceRegistry(config={
+        category: {'label': category, 'feeds': [
+            {'name': category, 'url': server.feed_url(category), 'weight': 1.0},
+            {'name': f"{category}_backup", 'url': server.feed_url(f"{category}_backup"), 'weight': 0.8},
+        ]}
+        for category in ('tech', 'business')
+    }, db=main.db)
+    stack.enter_context(mock.patch.object(main, 'source_registry', registry))
+
+    stack.enter_context(mock.patch.object(main.line_messenger, 'push_url',
+                                          f"{server.url}/v2/bot/message/push"))
+    stack.enter_context(mock.patch.object(main.line_messenger, 'multicast_url',
+                                          f"{server.url}/v2/bot/message/multicast"))
+    return main
+
+
+def seed_users(db, count):
+    for i in range(count):
+        db.collection('users').document(f"U{i:032d}").set({
+            'active': True,
+            'joined_at': datetime.now() - timedelta(days=i)
+        })
+
+
+def seed_expired_news(db, count):
+    expired = datetime.now() - timedelta(days=2)
+    for i in range(count):
+        db.collection('news').document().set({
+            'title': f"expired {i}",
+            'link': f"https://example.com/expired/{i}",
+            'category': 'tech',
+            'sent_at': expired,
+            'expire_at': expired + timedelta(days=1)
+        })
+
+
+def callback_body(event_count, subscribers):
+    """建立 LINE webhook 請求內容並簽章"""
+    commands = ['幫助', '狀態', 'hello', 'status', '說明']
+    events = []
+    for i in range(event_count):
+        events.append({
+            'type': 'message',
+            'replyToken': f"{i:032x}",
+            'source': {'type': 'user', 'userId': f"U{i % max(subscribers, 1):032d}"},
+            'timestamp': int(time.time() * 1000),
+            'mode': 'active',
+            'message': {'type': 'text', 'id': str(i), 'text': commands[i % len(commands)]}
+        })
+    body = json.dumps({'destination': 'Ubench', 'events': events})
+    signature = base64.b64encode(
+        hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    ).decode('utf-8')
+    return body, signature
+
+
+def call_route(main, path, method='GET', data=None, headers=None):
+    """以 Flask 的請求 context 呼叫 webhook 入口點"""
+    from flask import request
+    with main.app.test_request_context(path, method=method, data=data, headers=headers or {}):
+        response = main.webhook(request)
+    return response[1] if isinstance(response, tuple) else 200
+
+
+def run_scenario(name, iterations, prepare, invoke, verbose=False, units_per_call=1, db=None):
+    """執行單一情境並回傳延遲、吞吐量、記憶體與 Firestore 操作次數統計"""
+    latencies = []
+    firestore_ops = 0
+    statuses = {}
+
+    # 先暖身一次，排除延遲匯入與首次初始化對結果的影響
+    prepare()
+    with redirect_stdout(io.StringIO()):
+        invoke()
+
+    tracemalloc.start()
+    peak_bytes = 0
+    for _ in range(iterations):
+        prepare()
+        ops_before = sum(db.operations.values()) if db is not None else 0
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        if verbose:
+            status = invoke()
+        else:
+            with redirect_stdout(io.StringIO()):
+                status = invoke()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if db is not None:
+            firestore_ops += sum(db.operations.values()) - ops_before
+        # 只計入此次請求期間新增的峰值
+        peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1] - memory_before)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    tracemalloc.stop()
+
+    # 吞吐量只計入請求本身的時間，不含資料準備
+    busy = sum(latencies) / 1000
+
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(p95, 3),
+        'p99_ms': round(p99, 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_rps': round(iterations / busy, 2) if busy else 0.0,
+        'units_per_sec': round(iterations * units_per_call / busy, 1) if busy else 0.0,
+        'firestore_ops_per_unit': round(firestore_ops / (iterations * units_per_call), 3) if db else None,
+        'peak_kb': round(peak_bytes / 1024, 1),
+        'statuses': statuses,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """比較 p95 延遲與峰值記憶體，回傳退步清單"""
+    regressions = []
+    for result in results:
+        reference = baseline.get(result['scenario'])
+        if not reference:
+            continue
+        for key in ('p95_ms', 'peak_kb'):
+            if reference.get(key) and result[key] > reference[key] * (1 + tolerance):
+                regressions.append(f"{result['scenario']}.{key}: {result[key]} > "
+                                   f"{reference[key]} (+{tolerance:.0%})")
+    return regressions
+
+
+def main_cli():
+    args = parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    use_emulator = bool(os.environ.get('FIRESTORE_EMULATOR_HOST'))
+    db = None if use_emulator else FakeFirestore()
+
+    rss_fault = FaultInjector(args.rss_latency, args.rss_error_rate, args.seed)
+    line_fault = FaultInjector(args.line_latency, args.line_error_rate, args.seed)
+
+    with StandInServer(rss_fault, line_fault) as server, ExitStack() as stack:
+        app = install_stand_ins(stack, args, server, db)
+        db = db or app.db
+        seed_users(db, args.subscribers)
+
+        body, signature = callback_body(args.callback_events, args.subscribers)
+        replay_body, replay_signature = callback_body(args.replay_events, args.subscribers)
+
+        def replay_messages():
+            # 直接交給 WebhookHandler 處理並略過 LINE 回覆，只量測每則訊息的處理成本
+            with mock.patch.object(app.line_bot_api, 'reply_message'):
+                app.handler.handle(replay_body, replay_signature)
+            return 200
+
+        scenarios = {
+            'send_tech_news': (lambda: None, lambda: call_route(app, '/send_news?category=tech')),
+            'send_business_news': (lambda: None, lambda: call_route(app, '/send_news?category=business')),
+            'cleanup': (lambda: seed_expired_news(db, args.expired_records),
+                        lambda: call_route(app, '/cleanup')),
+            'callback': (lambda: None, lambda: call_route(
+                app, '/callback', 'POST', body,
+                {'X-Line-Signature': signature, 'Content-Type': 'application/json'})),
+            'message_replay': (lambda: None, replay_messages),
+        }
+        units = {'callback': args.callback_events, 'message_replay': args.replay_events}
+        fake_db = db if isinstance(db, FakeFirestore) else None
+
+        results = []
+        for name in args.scenarios.split(','):
+            name = name.strip()
+            prepare, invoke = scenarios[name]
+            results.append(run_scenario(name, args.iterations, prepare, invoke, args.verbose,
+                                        units.get(name, 1), fake_db))
+
+    print(f"{'scenario':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'msg/s':>10}"
+          f"{'fs ops':>8}{'peak KB':>10}  statuses")
+    for r in results:
+        print(f"{r['scenario']:<20}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['throughput_rps']:>10}{r['units_per_sec']:>10}{str(r['firestore_ops_per_unit']):>8}"
+              f"{r['peak_kb']:>10}  {r['statuses']}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({r['scenario']: r for r in results}, f, indent=2, ensure_ascii=False)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --update-baseline to create one.")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("Regressions detected:")
+        for line in regressions:
+            print(f"  • {line}")
+        return 1
+
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,61 @@
+import re
+
+# 比對整句指令時忽略結尾的標點與空白 (例如「讚！」)
+_TRAILING_PUNCTUATION = ' \t\r\n!！.。~～?？'
+
+
+class CommandRouter:
+    """將訊息中的關鍵字一次掃描對應到處理函數"""
+
+    def __init__(self, default_handler=None):
+        self.default_handler = default_handler
+        self._handlers = []
+        self._keyword_priority = {}
+        self._exact_priority = {}
+        self._pattern = None
+        self._compiled = False
+
+    def add(self, keywords, handler, exact=False):
+        """註冊一組關鍵字，越早註冊的優先順序越高
+
+        exact=True 時只有整則訊息等於關鍵字才算匹配，適合「讚」、「like」這類
+        容易出現在一般句子中的指令 (例如「讚嘆」、「unlikely」)。
+        """
+        priority = len(self._handlers)
+        self._handlers.append(handler)
+        table = self._exact_priority if exact else self._keyword_priority
+        for keyword in keywords:
+            table.setdefault(keyword.lower(), priority)
+        self._compiled = False
+        return handler
+
+    def _compile(self):
+        # 以 lookahead 在每個位置嘗試匹配，重疊的關鍵字 (例如「退訂閱」中的「退訂」與「訂閱」)
+        # 不會互相吞掉；同一位置依優先順序排列，先嘗試優先順序高的關鍵字，再以長度排序
+        keywords = sorted(self._keyword_priority, key=lambda k: (self._keyword_priority[k], -len(k)))
+        if keywords:
+            self._pattern = re.compile('(?=(' + '|'.join(re.escape(k) for k in keywords) + '))')
+        else:
+            self._pattern = None
+        self._compiled = True
+
+    def route(self, message):
+        """回傳優先順序最高的匹配處理函數，沒有匹配時回傳預設處理函數
+
+        子字串關鍵字的結果與依註冊順序逐一檢查「任一關鍵字是否出現在訊息中」相同。
+        """
+        if not self._compiled:
+            self._compile()
+
+        text = message.lower().strip()
+        best = self._exact_priority.get(text.rstrip(_TRAILING_PUNCTUATION))
+
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                priority = self._keyword_priority[match.group(1)]
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+
+        return self._handlers[best] if best is not None else self.default_handler
@@ -0,0 +1,148 @@
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta, timezone
+
+from metrics import metrics
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# LINE multicast 每次最多 500 位收件者
+MAX_CHUNK_SIZE = 500
+MAX_ATTEMPTS = 3
+# LINE retry key 由發送ID與分段序號推導，重疊執行的 create() 也會寫入相同的 key
+RETRY_KEY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'line-news-bot/deliveries')
+
+
+class DeliveryFinished(Exception):
+    """發送紀錄已經完成或放棄，不可再次建立"""
+
+    def __init__(self, delivery_id, status):
+        super().__init__(f"Delivery {delivery_id} already {status}")
+        self.delivery_id = delivery_id
+        self.status = status
+
+
+class DeliveryLedger:
+    """記錄每篇新聞、每個收件者分段 (chunk) 的發送狀態，讓中斷或重試的執行能從未發送的分段續傳
+
+    Firestore 結構：
+        deliveries/{delivery_id}                 發送整體狀態與訊息內容
+        deliveries/{delivery_id}/chunks/{index}  收件者、LINE retry key、狀態與嘗試次數
+    """
+
+    def __init__(self, db, chunk_size=None):
+        self.db = db
+        if chunk_size is None:
+            chunk_size = int(os.environ.get('DELIVERY_CHUNK_SIZE', str(MAX_CHUNK_SIZE)))
+        self.chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+
+    def _delivery_ref(self, delivery_id):
+        return self.db.collection('deliveries').document(delivery_id)
+
+    def _chunks_ref(self, delivery_id):
+        return self._delivery_ref(delivery_id).collection('chunks')
+
+    def retry_key(self, delivery_id, index):
+        """分段的 LINE X-Line-Retry-Key (同一分段永遠相同)"""
+        return str(uuid.uuid5(RETRY_KEY_NAMESPACE, f"{delivery_id}/{index}"))
+
+    def find_incomplete(self, category):
+        """找出此類別尚未完成的發送"""
+        query = (self.db.collection('deliveries')
+                 .where('category', '==', category)
+                 .where('status', '==', 'in_progress'))
+        with metrics.span('firestore.find_delivery', category=category):
+            for doc in query.stream():
+                return dict(doc.to_dict(), id=doc.id)
+        return None
+
+    def create(self, delivery_id, category, news_data, message, recipients, article_id=None):
+        """建立發送紀錄並切分收件者；進行中的紀錄 (例如重試) 直接返回，已結束的紀錄拋出 DeliveryFinished"""
+        delivery_ref = self._delivery_ref(delivery_id)
+        with metrics.span('firestore.create_delivery'):
+            existing = delivery_ref.get()
+            if existing.exists:
+                delivery = existing.to_dict()
+                if delivery['status'] != 'in_progress':
+                    raise DeliveryFinished(delivery_id, delivery['status'])
+                logger.info(f"Delivery {delivery_id} already exists, resuming")
+                return dict(delivery, id=delivery_id)
+
+            now = datetime.now(timezone.utc)
+            delivery = {
+                'category': category,
+                'title': news_data.title,
+                'link': news_data.link,
+                'source': news_data.source,
+                'article_id': article_id,
+                'message': message,
+                'status': 'in_progress',
+                'chunk_count': (len(recipients) + self.chunk_size - 1) // self.chunk_size,
+                'created_at': now,
+                'expire_at': now + timedelta(days=3),
+            }
+
+            # 檢查與寫入並非原子操作；重疊的執行可能覆寫分段，但 retry key 相同，LINE 只會處理一次
+            batch = self.db.batch()
+            for index, start in enumerate(range(0, len(recipients), self.chunk_size)):
+                batch.set(self._chunks_ref(delivery_id).document(f"{index:05d}"), {
+                    'index': index,
+                    'recipients': recipients[start:start + self.chunk_size],
+                    'retry_key': self.retry_key(delivery_id, index),
+                    'status': 'pending',
+                    'attempts': 0,
+                })
+                # Firestore 單一批次最多 500 筆寫入
+                if (index + 1) % 400 == 0:
+                    batch.commit()
+                    batch = self.db.batch()
+            # 最後寫入主文件，確保讀到 in_progress 時分段已存在
+            batch.set(delivery_ref, delivery)
+            batch.commit()
+
+        logger.info(f"Created delivery {delivery_id} with {delivery['chunk_count']} chunk(s)")
+        return dict(delivery, id=delivery_id)
+
+    def load_chunks(self, delivery_id):
+        """依序返回發送的所有分段"""
+        with metrics.span('firestore.load_chunks'):
+            chunks = [doc.to_dict() for doc in self._chunks_ref(delivery_id).stream()]
+        chunks.sort(key=lambda chunk: chunk['index'])
+        return chunks
+
+    def mark_chunk(self, delivery_id, chunk, sent, error=None):
+        """更新分段的發送結果"""
+        update = {
+            'status': 'sent' if sent else 'error',
+            'attempts': chunk['attempts'] + 1,
+            'updated_at': datetime.now(timezone.utc),
+        }
+        if sent:
+            update['sent_at'] = update['updated_at']
+        if error:
+            update['error'] = error[:500]
+        chunk.update(update)
+        with metrics.span('firestore.mark_chunk'):
+            self._chunks_ref(delivery_id).document(f"{chunk['index']:05d}").update(update)
+
+    def finish(self, delivery_id, status):
+        """將發送標記為 complete 或 failed"""
+        with metrics.span('firestore.finish_delivery'):
+            self._delivery_ref(delivery_id).update({
+                'status': status,
+                'finished_at': datetime.now(timezone.utc),
+            })
+
+    def delete_expired(self):
+        """刪除過期的發送紀錄及其分段，返回刪除的文件數"""
+        deleted_count = 0
+        expired = self.db.collection('deliveries').where('expire_at', '<=', datetime.now(timezone.utc)).stream()
+        for doc in expired:
+            for chunk in self._chunks_ref(doc.id).stream():
+                chunk.reference.delete()
+            doc.reference.delete()
+            deleted_count += 1
+        return deleted_count
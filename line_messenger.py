@@ -1,13 +1,20 @@
+import os
 import json
+import time
+import asyncio
 import requests
 from google.cloud import firestore
 from datetime import datetime, timedelta
 import logging
 
+from metrics import metrics
+from delivery_ledger import MAX_ATTEMPTS
+from async_io import runtime
+
 logger = logging.getLogger(__name__)
 
 class LineMessenger:
-    def __init__(self, channel_access_token):
+    def __init__(self, channel_access_token, ledger=None, db=None):
         self.channel_access_token = channel_access_token
         self.headers = {
             'Content-Type': 'application/json',
@@ -15,21 +22,27 @@ class LineMessenger:
         }
         self.push_url = 'https://api.line.me/v2/bot/message/push'
         self.multicast_url = 'https://api.line.me/v2/bot/message/multicast'
-        self.db = firestore.Client()
+        # 可傳入共用的 Firestore 客戶端，避免每次請求重新建立連線
+        self.db = db if db is not None else firestore.Client()
+        # 分段發送紀錄及單次執行的發送時間預算 (秒)
+        self.ledger = ledger
+        self.time_budget = float(os.environ.get('DELIVERY_TIME_BUDGET', '50'))
+        # 非同步發送時同時進行的分段數
+        self.concurrency = max(1, int(os.environ.get('DELIVERY_CONCURRENCY', '4')))
     
     def get_subscribers(self):
         """獲取所有訂閱用戶，最多5人"""
         users_ref = self.db.collection('users')
-        docs = users_ref.stream()
         
         user_ids = []
-        for doc in docs:
-            user_data = doc.to_dict()
-            if user_data.get('active', True):  # 只獲取活躍用戶
-                user_ids.append(doc.id)
-                # 限制最多5人，符合免費額度控制
-                if len(user_ids) >= 5:
-                    break
+        with metrics.span('firestore.get_subscribers'):
+            for doc in users_ref.stream():
+                user_data = doc.to_dict()
+                if user_data.get('active', True):  # 只獲取活躍用戶
+                    user_ids.append(doc.id)
+                    # 限制最多5人，符合免費額度控制
+                    if len(user_ids) >= 5:
+                        break
         
         logger.info(f"Found {len(user_ids)} active subscribers")
         return user_ids
@@ -37,21 +50,21 @@ class LineMessenger:
     def format_news_message(self, news_data):
         """格式化新聞訊息"""
         # 檢測語言
-        is_chinese = news_data.get('language', '').startswith('zh')
-        if not is_chinese and any('\u4e00' <= char <= '\u9fff' for char in news_data['title']):
+        is_chinese = (news_data.language or '').startswith('zh')
+        if not is_chinese and any('\u4e00' <= char <= '\u9fff' for char in news_data.title):
             is_chinese = True
         
         # 標題和摘要
         if is_chinese:
-            message_text = f"{news_data['title']}\n\n"
+            message_text = f"{news_data.title}\n\n"
         else:
             # 英文標題加引號更清晰
-            message_text = f"「{news_data['title']}」\n\n"
+            message_text = f"「{news_data.title}」\n\n"
 
-        message_text += f"{news_data['summary']}\n\n"
+        message_text += f"{news_data.summary}\n\n"
 
         # 處理關鍵資訊
-        if 'entities' in news_data and news_data['entities']:
+        if news_data.entities:
             message_text += "【關鍵資訊】\n"
 
             # 翻譯類型名稱
@@ -71,9 +84,9 @@ class LineMessenger:
             # 按優先順序顯示關鍵資訊
             displayed = False
             for entity_type in priority_order:
-                if entity_type in news_data['entities'] and news_data['entities'][entity_type]:
+                if news_data.entities.get(entity_type):
                     type_name = type_translations.get(entity_type, entity_type)
-                    message_text += f"• {type_name}：{', '.join(news_data['entities'][entity_type])}\n"
+                    message_text += f"• {type_name}：{', '.join(news_data.entities[entity_type])}\n"
                     displayed = True
             if not displayed:
                 message_text += "• 無顯著關鍵詞\n"
@@ -81,68 +94,193 @@ class LineMessenger:
             message_text += "【關鍵資訊】\n• 無顯著關鍵詞\n"
     
         # 添加原文連結
-        message_text += f"\n閱讀全文：{news_data['link']}"
+        message_text += f"\n閱讀全文：{news_data.link}"
         
         return message_text
         
     
-    def send_news(self, news_data, category):
-        """發送新聞到所有訂閱者"""
+    def build_message(self, news_data, category, category_label=None):
+        """建立LINE文字訊息物件"""
+        message_text = self.format_news_message(news_data)
+        if category_label is None:
+            category_label = "科技新聞" if category == "tech" else "商業新聞"
+        return {
+            "type": "text",
+            "text": f"【{category_label}】\n{message_text}"
+        }
+    
+    def deadline(self):
+        """從現在起算時間預算的截止時間 (time.monotonic)，應在請求開始時取得"""
+        return time.monotonic() + self.time_budget
+    
+    def deliver(self, news_data, category, delivery_id, category_label=None, article_id=None, deadline=None):
+        """透過發送紀錄分段發送新聞，返回 'complete'、'partial' 或 'failed'"""
         subscribers = self.get_subscribers()
         
         if not subscribers:
             logger.warning("No subscribers found")
-            return False
+            return 'failed'
         
-        # 檢查訂閱者數量是否超過限制
-        if len(subscribers) > 5:
-            logger.warning(f"Subscriber count ({len(subscribers)}) exceeds limit of 5. Only sending to first 5 subscribers.")
-            subscribers = subscribers[:5]
+        message = self.build_message(news_data, category, category_label)
+        delivery = self.ledger.create(delivery_id, category, news_data, message, subscribers, article_id)
+        return self.resume(delivery, deadline)
+    
+    def resume(self, delivery, deadline=None):
+        """從第一個未發送的分段繼續發送，超過截止時間時保留剩餘分段給下一次執行
+
+        deadline 未指定時從現在起算 DELIVERY_TIME_BUDGET。
+        """
+        delivery_id = delivery['id']
+        if deadline is None:
+            deadline = self.deadline()
+        chunks = self.ledger.load_chunks(delivery_id)
+        attempted = 0
         
-        # 準備消息內容
-        message_text = self.format_news_message(news_data)
+        for chunk in chunks:
+            if chunk['status'] == 'sent' or chunk['attempts'] >= MAX_ATTEMPTS:
+                continue
+            # 每次執行至少發送一個分段，確保續傳一定有進度
+            if attempted and time.monotonic() >= deadline:
+                logger.warning(f"Delivery {delivery_id} paused at chunk {chunk['index']} (time budget exceeded)")
+                return 'partial'
+            
+            logger.info(f"Sending chunk {chunk['index']} of {delivery_id} to {len(chunk['recipients'])} subscribers")
+            sent, error = self._multicast(chunk['recipients'], delivery['message'], chunk['retry_key'])
+            self.ledger.mark_chunk(delivery_id, chunk, sent, error)
+            attempted += 1
         
-        # 準備消息物件
-        category_label = "科技新聞" if category == "tech" else "商業新聞"
-        message = {
-            "type": "text",
-            "text": f"【{category_label}】\n{message_text}"
+        return self._settle(delivery, chunks)
+    
+    def _settle(self, delivery, chunks):
+        """依各分段狀態結束或保留發送紀錄，返回發送狀態"""
+        delivery_id = delivery['id']
+        record = (delivery['title'], delivery['link'], delivery.get('source'), delivery['category'], delivery_id)
+        if all(chunk['status'] == 'sent' for chunk in chunks):
+            self.ledger.finish(delivery_id, 'complete')
+            self.save_news_record(*record)
+            return 'complete'
+        
+        if any(chunk['status'] != 'sent' and chunk['attempts'] < MAX_ATTEMPTS for chunk in chunks):
+            # 仍有可重試的分段，交由下一次執行續傳
+            return 'partial'
+        
+        logger.error(f"Delivery {delivery_id} gave up after {MAX_ATTEMPTS} attempts")
+        self.ledger.finish(delivery_id, 'failed')
+        if any(chunk['status'] == 'sent' for chunk in chunks):
+            self.save_news_record(*record)
+        return 'failed'
+    
+    def _multicast_request(self, recipients, message, retry_key=None):
+        """準備 multicast 請求的標頭與內容"""
+        headers = self.headers
+        if retry_key:
+            # 相同 retry key 的請求 LINE 只會處理一次
+            headers = dict(self.headers, **{'X-Line-Retry-Key': retry_key})
+        
+        data = {
+            "to": recipients,
+            "messages": [message]
         }
+        return headers, json.dumps(data)
+    
+    def _multicast_result(self, status_code, text, retry_key=None):
+        """解讀 multicast API 的回應，返回 (是否成功, 錯誤訊息)"""
+        if status_code == 200:
+            return True, None
+        if status_code == 409 and retry_key:
+            # 此 retry key 的請求先前已被接受
+            logger.info(f"Multicast with retry key {retry_key} was already accepted")
+            return True, None
+        
+        logger.error(f"Failed to send news via multicast API: {status_code} - {text}")
+        return False, f"{status_code} {text}"
+    
+    def _multicast(self, recipients, message, retry_key=None):
+        """呼叫 multicast API，返回 (是否成功, 錯誤訊息)"""
+        headers, body = self._multicast_request(recipients, message, retry_key)
         
-        # 使用 multicast API 一次發送給所有訂閱者（最多5人）
         try:
-            data = {
-                "to": subscribers,
-                "messages": [message]
-            }
-            
-            logger.info(f"Sending news to {len(subscribers)} subscribers")
-            response = requests.post(self.multicast_url, headers=self.headers, data=json.dumps(data))
-            
-            if response.status_code == 200:
-                logger.info("News sent successfully via multicast API")
-                # 儲存發送記錄
-                self.save_news_record(news_data, category)
-                return True
-            else:
-                logger.error(f"Failed to send news via multicast API: {response.status_code} - {response.text}")
-                return False
-                
+            with metrics.span('line.multicast', recipients=len(recipients)):
+                response = requests.post(self.multicast_url, headers=headers, data=body)
+            return self._multicast_result(response.status_code, response.text, retry_key)
+        
         except Exception as e:
             logger.error(f"Error sending news via multicast API: {str(e)}")
-            return False
+            return False, str(e)
+    
+    async def _multicast_async(self, session, recipients, message, retry_key=None):
+        """_multicast 的非同步版本，使用共用的 aiohttp session"""
+        headers, body = self._multicast_request(recipients, message, retry_key)
+        
+        try:
+            with metrics.span('line.multicast', recipients=len(recipients)):
+                async with session.post(self.multicast_url, headers=headers, data=body) as response:
+                    text = await response.text()
+            return self._multicast_result(response.status, text, retry_key)
+        
+        except Exception as e:
+            logger.error(f"Error sending news via multicast API: {str(e)}")
+            return False, str(e)
+    
+    async def deliver_async(self, news_data, category, delivery_id, category_label=None, article_id=None,
+                            deadline=None):
+        """deliver 的非同步版本"""
+        if not runtime.enabled:
+            return await asyncio.to_thread(
+                self.deliver, news_data, category, delivery_id, category_label, article_id, deadline)
+        
+        subscribers = await asyncio.to_thread(self.get_subscribers)
+        
+        if not subscribers:
+            logger.warning("No subscribers found")
+            return 'failed'
+        
+        message = self.build_message(news_data, category, category_label)
+        delivery = await asyncio.to_thread(
+            self.ledger.create, delivery_id, category, news_data, message, subscribers, article_id)
+        return await self.resume_async(delivery, deadline)
+    
+    async def resume_async(self, delivery, deadline=None):
+        """resume 的非同步版本：每一輪同時發送最多 concurrency 個分段，輪與輪之間檢查截止時間"""
+        if not runtime.enabled:
+            return await asyncio.to_thread(self.resume, delivery, deadline)
+        
+        delivery_id = delivery['id']
+        if deadline is None:
+            deadline = self.deadline()
+        chunks = await asyncio.to_thread(self.ledger.load_chunks, delivery_id)
+        pending = [chunk for chunk in chunks
+                   if chunk['status'] != 'sent' and chunk['attempts'] < MAX_ATTEMPTS]
+        session = await runtime.get_session()
+        
+        async def send_chunk(chunk):
+            logger.info(f"Sending chunk {chunk['index']} of {delivery_id} to {len(chunk['recipients'])} subscribers")
+            sent, error = await self._multicast_async(
+                session, chunk['recipients'], delivery['message'], chunk['retry_key'])
+            await asyncio.to_thread(self.ledger.mark_chunk, delivery_id, chunk, sent, error)
+        
+        for start in range(0, len(pending), self.concurrency):
+            # 每次執行至少發送一輪，確保續傳一定有進度
+            if start and time.monotonic() >= deadline:
+                logger.warning(f"Delivery {delivery_id} paused at chunk {pending[start]['index']} (time budget exceeded)")
+                return 'partial'
+            await asyncio.gather(*(send_chunk(chunk) for chunk in pending[start:start + self.concurrency]))
+        
+        return await asyncio.to_thread(self._settle, delivery, chunks)
     
-    def save_news_record(self, news_data, category):
-        """保存新聞記錄到Firestore"""
+    def save_news_record(self, title, link, source, category, record_id=None):
+        """保存新聞記錄到Firestore (指定 record_id 時重複保存不會產生多筆)"""
         try:
-            news_ref = self.db.collection('news').document()
-            news_ref.set({
-                'title': news_data['title'],
-                'link': news_data['link'],
-                'category': category,
-                'sent_at': datetime.now(),
-                'expire_at': datetime.now() + timedelta(days=1)  # 設置1天後過期
-            })
-            logger.info(f"News record saved: {news_data['title'][:50]}...")
+            news_ref = self.db.collection('news').document(record_id)
+            with metrics.span('firestore.save_news_record'):
+                news_ref.set({
+                    'title': title,
+                    'link': link,
+                    'category': category,
+                    'source': source,
+                    'sent_at': datetime.now(),
+                    'expire_at': datetime.now() + timedelta(days=1)  # 設置1天後過期
+                })
+            logger.info(f"News record saved: {title[:50]}...")
         except Exception as e:
             logger.error(f"Error saving news record: {str(e)}")
\ No newline at end of file
@@ -1,8 +1,9 @@
 import os
 import json
+import asyncio
 from flask import Flask
 from google.cloud import firestore
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 from functions_framework import http
 
@@ -10,6 +11,15 @@ from functions_framework import http
 from news_crawler import NewsCrawler
 from news_summarizer import NewsSummarizer
 from line_messenger import LineMessenger
+from metrics import metrics
+from memory_profile import memory_profiler
+from command_router import CommandRouter
+from user_cache import UserCache
+from source_registry import SourceRegistry
+from recency import RecencyTracker
+from news_ranker import NewsRanker, article_id
+from delivery_ledger import DeliveryLedger, DeliveryFinished
+from async_io import runtime as async_runtime
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +35,25 @@ LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '')
 # 初始化Firestore
 db = firestore.Client()
 
+# 新聞來源註冊表 (跨請求保留來源健康狀態)
+source_registry = SourceRegistry(db=db)
+
+# 新聞時效判斷與各來源高水位 (Asia/Taipei 時區)
+recency_tracker = RecencyTracker(db=db)
+
+# 候選文章排序 (時效、來源權重、跨來源報導數、用戶回饋)
+news_ranker = NewsRanker(db=db, recency=recency_tracker)
+
+# 分段發送紀錄 (可續傳、不重複發送)
+delivery_ledger = DeliveryLedger(db)
+
+# 用戶文件快取 (關注、取消關注及取消訂閱時更新)
+user_cache = UserCache()
+
+# 摘要器與推送器在實例的生命週期內共用 (NL API、Gemini 與 Firestore 客戶端只建立一次)
+news_summarizer = NewsSummarizer()
+line_messenger = LineMessenger(LINE_CHANNEL_ACCESS_TOKEN, ledger=delivery_ledger, db=db)
+
 # Line相關處理
 from linebot import (
     LineBotApi, WebhookHandler
@@ -48,30 +77,36 @@ def handle_follow(event):
     
     # 檢查當前訂閱人數
     users_ref = db.collection('users')
-    current_subscribers = len(list(users_ref.stream()))
+    with metrics.span('firestore.count_users'):
+        current_subscribers = len(list(users_ref.stream()))
     
     if current_subscribers >= 5:
         # 超過5人限制，拒絕新用戶
         welcome_message = "很抱歉，目前訂閱人數已達上限，暫時無法提供服務。"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=welcome_message)
-        )
+        with metrics.span('line.reply'):
+            line_bot_api.reply_message(
+                event.reply_token,
+                TextSendMessage(text=welcome_message)
+            )
         return
     
     # 將用戶添加到訂閱資料庫
     user_ref = db.collection('users').document(user_id)
-    user_ref.set({
+    user_data = {
         'active': True,
         'joined_at': datetime.now()
-    })
+    }
+    with metrics.span('firestore.set_user'):
+        user_ref.set(user_data)
+    user_cache.put(user_id, user_data)
     
     # 發送歡迎訊息
     welcome_message = "感謝您的訂閱！\n每天早上8:30和下午13:00，您將收到精選的科技和商業新聞摘要。\n\n您可以發送任何訊息來測試機器人回應。"
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=welcome_message)
-    )
+    with metrics.span('line.reply'):
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text=welcome_message)
+        )
 
 @handler.add(UnfollowEvent)
 def handle_unfollow(event):
@@ -81,7 +116,61 @@ def handle_unfollow(event):
     
     # 從資料庫中移除用戶
     user_ref = db.collection('users').document(user_id)
-    user_ref.delete()
+    with metrics.span('firestore.delete_user'):
+        user_ref.delete()
+    user_cache.put(user_id, None)
+
+# 訊息指令處理函數 (參數：用戶ID、原始訊息、用戶資料)
+def reply_help(user_id, user_message, user_data):
+    return """可用指令：
+• 發送「狀態」查看訂閱狀態
+• 發送「取消」取消訂閱
+• 發送「讚」或「不喜歡」回饋最近一則新聞
+• 每天8:30和13:00會自動推送新聞"""
+
+def reply_status(user_id, user_message, user_data):
+    joined_date = user_data.get('joined_at', datetime.now()).strftime('%Y-%m-%d')
+    return f"您的訂閱狀態：\n• 狀態：已訂閱\n• 訂閱日期：{joined_date}\n• 推送時間：每天8:30、13:00"
+
+def reply_cancel(user_id, user_message, user_data):
+    with metrics.span('firestore.delete_user'):
+        db.collection('users').document(user_id).delete()
+    user_cache.put(user_id, None)
+    return "已成功取消訂閱。如需重新訂閱，請重新關注此帳號。"
+
+def reply_reaction(positive):
+    """建立回饋指令的處理函數，回饋會計入最近一則推送新聞的來源"""
+    def handler(user_id, user_message, user_data):
+        latest = (db.collection('news')
+                  .order_by('sent_at', direction=firestore.Query.DESCENDING)
+                  .limit(1).stream())
+        latest_news = next(iter(latest), None)
+        if latest_news is None:
+            return "目前沒有可回饋的新聞。"
+        counted = news_ranker.record_reaction(latest_news.to_dict().get('source'), positive,
+                                              user_id=user_id, news_id=latest_news.id)
+        if not counted:
+            return "您已回饋過這則新聞，感謝您的參與！"
+        return "感謝您的回饋！我們會據此調整新聞挑選。"
+    return handler
+
+def reply_echo(user_id, user_message, user_data):
+    return f"收到您的訊息：「{user_message}」\n\n如需幫助，請發送「幫助」查看可用指令。"
+
+# 關鍵字對應，先註冊者優先 (例如「取消訂閱」、「退訂閱」含有「訂閱」，會對應到狀態查詢，與原本依序 any() 檢查一致)
+command_router = CommandRouter(default_handler=reply_echo)
+command_router.add(['幫助', 'help', '說明', '指令'], reply_help)
+command_router.add(['狀態', 'status', '訂閱'], reply_status)
+command_router.add(['取消', 'unsubscribe', '退訂'], reply_cancel)
+# 回饋指令需整則訊息完全相符，避免「讚嘆」、「unlikely」等一般訊息被計為回饋
+command_router.add(['不喜歡', 'dislike', '👎'], reply_reaction(False), exact=True)
+command_router.add(['讚', '喜歡', 'like', '👍'], reply_reaction(True), exact=True)
+
+def load_user(user_id):
+    """從Firestore讀取用戶資料，不存在時返回None"""
+    with metrics.span('firestore.get_user'):
+        user_doc = db.collection('users').document(user_id).get()
+    return user_doc.to_dict() if user_doc.exists else None
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
@@ -90,107 +179,101 @@ def handle_message(event):
     user_message = event.message.text
     logger.info(f"Received message from {user_id}: {user_message}")
     
-    # 檢查用戶是否在訂閱列表中
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
+    # 檢查用戶是否在訂閱列表中 (優先使用快取)
+    user_data = user_cache.get(user_id, lambda: load_user(user_id))
     
-    if not user_doc.exists:
+    if user_data is None:
         # 用戶不在訂閱列表中
         reply_message = "您尚未訂閱新聞服務。請先關注此帳號以開始接收新聞。"
     else:
         # 根據用戶訊息提供相應回應
-        message_lower = user_message.lower().strip()
-        
-        if any(keyword in message_lower for keyword in ['幫助', 'help', '說明', '指令']):
-            reply_message = """可用指令：
-• 發送「狀態」查看訂閱狀態
-• 發送「取消」取消訂閱
-• 每天8:30和13:00會自動推送新聞"""
-        
-        elif any(keyword in message_lower for keyword in ['狀態', 'status', '訂閱']):
-            user_data = user_doc.to_dict()
-            joined_date = user_data.get('joined_at', datetime.now()).strftime('%Y-%m-%d')
-            reply_message = f"您的訂閱狀態：\n• 狀態：已訂閱\n• 訂閱日期：{joined_date}\n• 推送時間：每天8:30、13:00"
-        
-        elif any(keyword in message_lower for keyword in ['取消', 'unsubscribe', '退訂']):
-            user_ref.delete()
-            reply_message = "已成功取消訂閱。如需重新訂閱，請重新關注此帳號。"
-        
-        else:
-            reply_message = f"收到您的訊息：「{user_message}」\n\n如需幫助，請發送「幫助」查看可用指令。"
+        reply_handler = command_router.route(user_message)
+        reply_message = reply_handler(user_id, user_message, user_data)
     
     # 回覆訊息
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=reply_message)
-    )
+    with metrics.span('line.reply'):
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text=reply_message)
+        )
 
 # 各功能處理函數
-def send_tech_news_handler():
-    """處理發送科技新聞的邏輯"""
+def send_news_handler(category):
+    """處理發送特定類別新聞的邏輯"""
+    if category not in source_registry.categories:
+        logger.warning(f"Unknown news category: {category}")
+        return f"Unknown category: {category}", 400
+    
     try:
-        logger.info("Starting to fetch tech news")
-        # 爬取最新科技新聞
-        crawler = NewsCrawler()
-        news_item = crawler.fetch_news('tech')
-        
-        if not news_item:
-            logger.warning("No tech news found")
-            return "No tech news found", 404
-        
-        # 生成摘要
-        logger.info("Generating summary for tech news")
-        summarizer = NewsSummarizer()
-        summary = summarizer.summarize(news_item)
-        
-        # 發送到Line
-        logger.info("Sending tech news to subscribers")
-        messenger = LineMessenger(LINE_CHANNEL_ACCESS_TOKEN)
-        result = messenger.send_news(summary, 'tech')
-        
-        if result:
-            logger.info("Tech news sent successfully")
-            return "Tech news sent successfully", 200
-        else:
-            logger.error("Failed to send tech news")
-            return "Failed to send tech news", 500
+        # 爬取、摘要與發送在共用的事件迴圈中以非同步 I/O 執行
+        return async_runtime.run(send_news_async(category))
     
     except Exception as e:
-        logger.error(f"Error sending tech news: {str(e)}")
+        logger.error(f"Error sending {category} news: {str(e)}")
         return f"Error: {str(e)}", 500
 
-def send_business_news_handler():
-    """處理發送商業新聞的邏輯"""
-    try:
-        logger.info("Starting to fetch business news")
-        # 爬取最新商業新聞
-        crawler = NewsCrawler()
-        news_item = crawler.fetch_news('business')
-        
-        if not news_item:
-            logger.warning("No business news found")
-            return "No business news found", 404
+async def send_news_async(category):
+    """發送新聞的非同步流程：同時下載所有來源，摘要與實體提取並行，分段並行發送"""
+    # 發送時間預算從請求開始起算，爬取與摘要的時間也計入，避免超過函數逾時
+    deadline = line_messenger.deadline()
+    
+    # 先續傳此類別未完成的發送 (前一次逾時、中斷或排程重試)
+    pending_delivery = await asyncio.to_thread(delivery_ledger.find_incomplete, category)
+    if pending_delivery:
+        logger.info(f"Resuming delivery {pending_delivery['id']}")
+        status = await line_messenger.resume_async(pending_delivery, deadline)
+        if status != 'failed':
+            # 中斷前的執行沒有機會標記，續傳後補上，避免之後再次挑選同一篇文章
+            await asyncio.to_thread(news_ranker.mark_sent, pending_delivery.get('article_id'))
+        return delivery_response(category, status)
+    
+    logger.info(f"Starting to fetch {category} news")
+    # 爬取各來源的新文章，並挑選分數最高的一篇
+    crawler = NewsCrawler(source_registry, recency_tracker)
+    candidates = await crawler.fetch_candidates_async(category)
+    skipped = set()
+    
+    while True:
+        news_item = await asyncio.to_thread(news_ranker.select, candidates, category)
+        if not news_item or news_item.id in skipped:
+            logger.warning(f"No {category} news found")
+            return f"No {category} news found", 404
         
         # 生成摘要
-        logger.info("Generating summary for business news")
-        summarizer = NewsSummarizer()
-        summary = summarizer.summarize(news_item)
-        
-        # 發送到Line
-        logger.info("Sending business news to subscribers")
-        messenger = LineMessenger(LINE_CHANNEL_ACCESS_TOKEN)
-        result = messenger.send_news(summary, 'business')
+        logger.info(f"Generating summary for {category} news")
+        summary = await news_summarizer.summarize_async(news_item)
         
-        if result:
-            logger.info("Business news sent successfully")
-            return "Business news sent successfully", 200
-        else:
-            logger.error("Failed to send business news")
-            return "Failed to send business news", 500
+        # 發送到Line (以文章ID作為發送紀錄ID，重試時不會重複發送)
+        logger.info(f"Sending {category} news to subscribers")
+        news_id = news_item.id or article_id(news_item.link)
+        delivery_id = f"{category}_{news_id}"
+        try:
+            status = await line_messenger.deliver_async(
+                summary, category, delivery_id, source_registry.label(category), news_id, deadline)
+            break
+        except DeliveryFinished as e:
+            # 這篇文章先前已發送過 (或已放棄)，標記後在同一次執行中改挑下一篇
+            await asyncio.to_thread(news_ranker.mark_sent, news_id)
+            skipped.add(news_id)
+            logger.warning(f"{e}, selecting next {category} news")
     
-    except Exception as e:
-        logger.error(f"Error sending business news: {str(e)}")
-        return f"Error: {str(e)}", 500
+    if status != 'failed':
+        # 發送紀錄建立後即由紀錄負責續傳，因此推進高水位；完全失敗時下次會重新處理同一篇文章
+        await asyncio.to_thread(crawler.commit)
+        await asyncio.to_thread(news_ranker.mark_sent, news_id)
+    return delivery_response(category, status)
+
+def delivery_response(category, status):
+    """將發送狀態轉換為HTTP回應，未完成時回傳503讓 Cloud Scheduler 重試續傳"""
+    if status == 'complete':
+        logger.info(f"{category} news sent successfully")
+        return f"{category} news sent successfully", 200
+    elif status == 'partial':
+        logger.warning(f"{category} news partially sent, remaining chunks will resume on retry")
+        return f"{category} news partially sent, will resume", 503
+    else:
+        logger.error(f"Failed to send {category} news")
+        return f"Failed to send {category} news", 500
 
 def cleanup_handler():
     """處理清理過期新聞的邏輯"""
@@ -203,9 +286,30 @@ def cleanup_handler():
         
         # 刪除過期記錄
         deleted_count = 0
-        for doc in expired_news:
-            doc.reference.delete()
-            deleted_count += 1
+        with metrics.span('firestore.cleanup'):
+            for doc in expired_news:
+                doc.reference.delete()
+                deleted_count += 1
+        
+        # 刪除過期的文章分數紀錄
+        expired_scores = (db.collection('article_scores')
+                          .where('expire_at', '<=', datetime.now(timezone.utc)).stream())
+        with metrics.span('firestore.cleanup_scores'):
+            for doc in expired_scores:
+                doc.reference.delete()
+                deleted_count += 1
+        
+        # 刪除過期的回饋去重紀錄
+        expired_votes = (db.collection('reaction_votes')
+                         .where('expire_at', '<=', datetime.now(timezone.utc)).stream())
+        with metrics.span('firestore.cleanup_reaction_votes'):
+            for doc in expired_votes:
+                doc.reference.delete()
+                deleted_count += 1
+        
+        # 刪除過期的發送紀錄
+        with metrics.span('firestore.cleanup_deliveries'):
+            deleted_count += delivery_ledger.delete_expired()
         
         logger.info(f"Cleaned up {deleted_count} expired news records")
         return f"Cleaned up {deleted_count} expired news records", 200
@@ -223,7 +327,18 @@ def webhook(request):
     
     logger.info(f"Received {method} request to {path}")
     
-    # 根據路徑和方法分發請求
+    try:
+        with memory_profiler.profile(path) as memory_report:
+            with metrics.span('request', path=path, method=method):
+                response = route_request(request, path, method)
+        # 啟用 MEMORY_PROFILE 時在回應標頭附上記憶體峰值
+        return memory_profiler.attach(response, memory_report)
+    finally:
+        # 每個請求結束時輸出後備計數
+        metrics.flush()
+
+def route_request(request, path, method):
+    """根據路徑和方法分發請求"""
     if path == '/callback' and method == 'POST':
         # 處理Line的Webhook請求
         signature = request.headers.get('X-Line-Signature', '')
@@ -248,13 +363,13 @@ def webhook(request):
         # 處理根路徑請求（健康檢查）
         return ('Line Bot Server is running!', 200)
     
-    elif path == '/send_tech_news':
-        # 處理發送科技新聞請求
-        return send_tech_news_handler()
+    elif path == '/send_news':
+        # 處理發送新聞請求，類別由查詢參數指定 (例如 /send_news?category=tech)
+        return send_news_handler(request.args.get('category', ''))
     
-    elif path == '/send_business_news':
-        # 處理發送商業新聞請求
-        return send_business_news_handler()
+    elif path.startswith('/send_') and path.endswith('_news'):
+        # 相容舊路徑 /send_tech_news、/send_business_news
+        return send_news_handler(path[len('/send_'):-len('_news')])
     
     elif path == '/cleanup':
         # 處理清理過期新聞請求
@@ -0,0 +1,124 @@
+import os
+import re
+import json
+import time
+import logging
+import tracemalloc
+from contextlib import contextmanager
+
+# resource 只存在於 Unix，其他平台不回報 RSS
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MemoryProfiler:
+    """以 tracemalloc 記錄每個路由的記憶體用量，並在回應標頭回報峰值
+
+    啟用後每個請求會在前後各取一次 snapshot，將差異最大的配置位置輸出為 JSON 日誌；
+    設定 MEMORY_PROFILE_DIR 時另外保存 snapshot 檔，可用 tracemalloc.Snapshot.load() 離線分析。
+    tracemalloc 會讓配置變慢，只應在診斷時啟用。
+    """
+
+    def __init__(self, enabled=None, top=None, snapshot_dir=None):
+        if enabled is None:
+            enabled = os.environ.get('MEMORY_PROFILE', '').lower() in ('1', 'true', 'yes')
+        if top is None:
+            top = int(os.environ.get('MEMORY_PROFILE_TOP', '10'))
+        if snapshot_dir is None:
+            snapshot_dir = os.environ.get('MEMORY_PROFILE_DIR') or None
+
+        self.enabled = enabled
+        self.top = top
+        self.snapshot_dir = snapshot_dir
+
+    def peak_rss_kb(self):
+        """行程到目前為止的最大常駐記憶體 (KB)"""
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextmanager
+    def profile(self, route):
+        """量測一個請求，停用時返回None；啟用時返回的 dict 會在請求結束後填入結果"""
+        if not self.enabled:
+            yield None
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        report = {}
+        before = tracemalloc.take_snapshot()
+        # snapshot 本身的配置不計入請求的峰值
+        tracemalloc.reset_peak()
+        current_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield report
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            report['traced_peak_kb'] = round((peak - current_before) / 1024, 1)
+            report['traced_retained_kb'] = round((current - current_before) / 1024, 1)
+            report['peak_rss_kb'] = self.peak_rss_kb()
+            self._emit(route, report, self._filter(after).compare_to(self._filter(before), 'lineno')[:self.top])
+            if self.snapshot_dir:
+                self._dump(route, after)
+
+    def _filter(self, snapshot):
+        """排除 tracemalloc 自身的配置"""
+        return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def headers(self, report):
+        """轉換為回應標頭"""
+        headers = {
+            'X-Memory-Traced-Peak-KB': str(report['traced_peak_kb']),
+            'X-Memory-Traced-Retained-KB': str(report['traced_retained_kb']),
+        }
+        if report['peak_rss_kb'] is not None:
+            headers['X-Memory-Peak-RSS-KB'] = str(report['peak_rss_kb'])
+        return headers
+
+    def attach(self, response, report):
+        """將量測結果加入 (body, status) 形式的回應"""
+        if report is None:
+            return response
+        body, status = response[0], response[1]
+        headers = dict(response[2]) if len(response) > 2 else {}
+        headers.update(self.headers(report))
+        return body, status, headers
+
+    def _emit(self, route, report, top_stats):
+        """以單行 JSON 輸出，格式與 metrics 相同"""
+        logger.info(json.dumps({
+            'severity': 'INFO',
+            'message': f"memory {route} peak {report['traced_peak_kb']}KB",
+            'route': route,
+            **report,
+            'top_allocations': [
+                {
+                    'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    'size_diff_kb': round(stat.size_diff / 1024, 1),
+                    'count_diff': stat.count_diff,
+                }
+                for stat in top_stats
+            ],
+        }, ensure_ascii=False, default=str))
+
+    def _dump(self, route, snapshot):
+        """保存 snapshot 檔 (檔名含路由與時間)"""
+        name = re.sub(r'[^A-Za-z0-9_]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.snapshot_dir, f"{name}_{int(time.time() * 1000)}.snapshot")
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            snapshot.dump(path)
+        except OSError as e:
+            logger.warning(f"Failed to dump memory snapshot: {str(e)}")
+
+
+# 全域共用實例
+memory_profiler = MemoryProfiler()
@@ -1,84 +1,216 @@
+import os
+import time
+import asyncio
 import feedparser
 import requests
-from datetime import datetime, timedelta
 import logging
 
+try:
+    import aiohttp
+except ImportError:  # 未安裝時 runtime.enabled 為 False，只使用同步流程
+    aiohttp = None
+
+from metrics import metrics
+from source_registry import SourceRegistry
+from recency import RecencyTracker
+from async_io import runtime
+from news_models import NewsItem
+
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class NewsCrawler:
-    def __init__(self):
-        # 定義RSS源
-        self.tech_sources = {
-            'primary': 'https://techcrunch.com/feed/',
-            'backup': 'https://www.bnext.com.tw/rss'  # 數位時代
-        }
-        
-        self.business_sources = {
-            'primary': 'https://money.udn.com/rssfeed/news/1001/5591/5612?ch=money', #經濟日報產業別 
-            'backup': 'https://fortune.com/feed/'  
-        }
+    def __init__(self, registry=None, recency=None):
+        # RSS源註冊表 (類別、權重及健康狀態)
+        self.registry = registry or SourceRegistry()
+        # 時效判斷與各來源的高水位紀錄
+        self.recency = recency or RecencyTracker()
+        # 本次執行暫存的來源狀態更新，發送成功後才寫入
+        self.pending_state = {}
+        self.timeout = float(os.environ.get('FEED_TIMEOUT', '10'))
     
-    def fetch_news(self, category):
-        """抓取特定類別的新聞"""
-        if category not in ['tech', 'business']:
-            raise ValueError("Category must be 'tech' or 'business'")
-        
-        sources = self.tech_sources if category == 'tech' else self.business_sources
+    def commit(self):
+        """新聞發送成功後，保存各來源的高水位與快取驗證標頭"""
+        self.recency.commit(self.pending_state)
+        self.pending_state = {}
+    
+    def _stage(self, feed_name, **updates):
+        """暫存來源狀態更新"""
+        self.pending_state.setdefault(feed_name, {}).update(updates)
+    
+    def _request_headers(self, feed_source):
+        """使用條件式請求，來源沒有更新時直接略過解析"""
+        headers = {'User-Agent': feedparser.USER_AGENT}
+        etag, modified = self.recency.validators(feed_source.name)
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+    
+    def _parse_response(self, feed_source, status_code, content, headers):
+        """解析回應並暫存驗證標頭，返回 (feed, not_modified)"""
+        if status_code == 304:
+            logger.info(f"{feed_source.name} not modified since last run")
+            return None, True
+        feed = feedparser.parse(content)
+        self._stage(feed_source.name,
+                    etag=headers.get('ETag'),
+                    modified=headers.get('Last-Modified'))
+        return feed, False
+    
+    def _fetch_feed(self, feed_source, category):
+        """下載並解析單一RSS源，同時記錄延遲和成功與否"""
+        start = time.perf_counter()
+        feed = None
+        not_modified = False
+        headers = self._request_headers(feed_source)
         
-        # 首先嘗試主要源
         try:
-            feed = feedparser.parse(sources['primary'])
-            if feed.entries and len(feed.entries) > 0:
-                logger.info(f"Successfully fetched news from primary {category} source")
-                return self._process_feed(feed, 'primary')
+            with metrics.span('feed_parse', category=category, source=feed_source.name):
+                response = requests.get(feed_source.url, timeout=self.timeout, headers=headers)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                feed, not_modified = self._parse_response(
+                    feed_source, response.status_code, response.content, response.headers)
         except Exception as e:
-            logger.warning(f"Failed to fetch from primary {category} source: {str(e)}")
+            logger.warning(f"Failed to fetch from {feed_source.name} ({category}): {str(e)}")
+        
+        success = not_modified or (feed is not None and len(feed.entries) > 0)
+        self.registry.record(feed_source, success, time.perf_counter() - start)
+        return feed
+    
+    async def _fetch_feed_async(self, session, feed_source, category):
+        """_fetch_feed 的非同步版本，以共用的 aiohttp session 下載，解析交給執行緒"""
+        start = time.perf_counter()
+        feed = None
+        not_modified = False
+        headers = await asyncio.to_thread(self._request_headers, feed_source)
         
-        # 如果主要源失敗，嘗試備用源
         try:
-            feed = feedparser.parse(sources['backup'])
-            if feed.entries and len(feed.entries) > 0:
-                logger.info(f"Successfully fetched news from backup {category} source")
-                return self._process_feed(feed, 'backup')
+            with metrics.span('feed_parse', category=category, source=feed_source.name):
+                # 單一來源的逾時與同步版本相同 (FEED_TIMEOUT)，不使用 session 的預設值
+                async with session.get(feed_source.url, headers=headers,
+                                       timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                    if response.status != 304:
+                        response.raise_for_status()
+                    content = await response.read()
+                feed, not_modified = await asyncio.to_thread(
+                    self._parse_response, feed_source, response.status, content, response.headers)
         except Exception as e:
-            logger.error(f"Failed to fetch from backup {category} source: {str(e)}")
-            return None
+            logger.warning(f"Failed to fetch from {feed_source.name} ({category}): {str(e)}")
         
-        return None
+        success = not_modified or (feed is not None and len(feed.entries) > 0)
+        await asyncio.to_thread(self.registry.record, feed_source, success, time.perf_counter() - start)
+        return feed
     
-    def _process_feed(self, feed, source_type):
-        """處理RSS Feed並返回最新的文章"""
-        # 獲取當天的新聞
-        today = datetime.now().date()
-        recent_entries = []
+    def _new_entries(self, feed, source_type):
+        """返回高水位之後、今天或昨天發布的文章 [(發布時間, entry)]，未來的發布時間以目前時間計"""
+        now = self.recency.now()
+        watermark = self.recency.watermark(source_type)
+        new_entries = []
+        skipped_undated = 0
+        skipped_malformed = 0
         
         for entry in feed.entries:
-            # 解析發布日期
-            if 'published_parsed' in entry:
-                publish_date = datetime(*entry.published_parsed[:6]).date()
-            elif 'updated_parsed' in entry:
-                publish_date = datetime(*entry.updated_parsed[:6]).date()
-            else:
-                # 如果沒有日期信息，假設是最近的
-                publish_date = today
+            # 缺少標題或連結的項目無法推送，略過而不影響同一來源的其他文章
+            if not entry.get('title') or not entry.get('link'):
+                skipped_malformed += 1
+                continue
             
-            # 檢查是否是今天或昨天的文章
-            if (today - publish_date).days <= 1:
-                recent_entries.append({
-                    'title': entry.title,
-                    'link': entry.link,
-                    'summary': entry.summary if 'summary' in entry else '',
-                    'published': publish_date.isoformat(),
-                    'source': source_type
-                })
+            # 解析發布日期 (UTC aware datetime)
+            publish_time = self.recency.entry_timestamp(entry)
+            if publish_time is None:
+                # 沒有日期信息的文章無法判斷新舊，直接略過
+                skipped_undated += 1
+                continue
+            
+            # 已處理過或不是今天、昨天的文章不再處理
+            if watermark is not None and publish_time <= watermark:
+                continue
+            if not self.recency.is_recent(publish_time, now):
+                continue
+            
+            new_entries.append((self.recency.clamp(publish_time, now), entry))
+        
+        if skipped_undated:
+            logger.info(f"Skipped {skipped_undated} undated entries from {source_type}")
+        if skipped_malformed:
+            logger.warning(f"Skipped {skipped_malformed} entries without title or link from {source_type}")
+        if not new_entries:
+            logger.info(f"No new entries from {source_type} since {watermark}")
+        return new_entries
+    
+    def _to_news_item(self, entry, publish_time, source_type, weight=1.0):
+        """將RSS entry轉換為新聞資料 (只保留需要的欄位，不保留整個 entry)"""
+        return NewsItem(
+            title=entry.get('title'),
+            link=entry.get('link'),
+            summary=entry.get('summary', ''),
+            published=publish_time.astimezone(self.recency.tz).isoformat(),
+            source=source_type,
+            weight=weight,
+            id=None
+        )
+    
+    def _collect(self, feed_source, feed, per_feed_limit):
+        """將單一來源的新文章轉換為候選，並暫存推進後的高水位
+
+        處理失敗時只捨棄這個來源 (連同暫存的驗證標頭，下次重新下載)，不影響其他來源。
+        """
+        if feed is None or not feed.entries:
+            return []
+        
+        try:
+            with metrics.span('process_feed', source=feed_source.name):
+                new_entries = self._new_entries(feed, feed_source.name)
+                if not new_entries:
+                    return []
+                
+                new_entries.sort(key=lambda pair: pair[0], reverse=True)
+                items = [self._to_news_item(entry, publish_time, feed_source.name, feed_source.weight)
+                         for publish_time, entry in new_entries[:per_feed_limit]]
+        except Exception as e:
+            logger.warning(f"Failed to process entries from {feed_source.name}: {str(e)}")
+            self.pending_state.pop(feed_source.name, None)
+            return []
+        
+        # 所有新文章都會進入排序紀錄，因此高水位推進到最新一篇
+        self._stage(feed_source.name, high_water_mark=new_entries[0][0])
+        return items
+    
+    def fetch_candidates(self, category, per_feed_limit=50):
+        """從所有可用來源收集新文章作為排序候選"""
+        candidates = []
+        with metrics.span('fetch_candidates', category=category):
+            for feed_source in self.registry.ordered_feeds(category):
+                # 不以變數保留 Feed，下載下一個來源時前一份解析結果已可回收
+                candidates.extend(self._collect(
+                    feed_source, self._fetch_feed(feed_source, category), per_feed_limit))
+        
+        logger.info(f"Collected {len(candidates)} {category} candidates")
+        return candidates
+    
+    async def fetch_candidates_async(self, category, per_feed_limit=50):
+        """fetch_candidates 的非同步版本：同時下載所有來源"""
+        if not runtime.enabled:
+            return await asyncio.to_thread(self.fetch_candidates, category, per_feed_limit)
+        
+        feeds = self.registry.ordered_feeds(category)
+        session = await runtime.get_session()
+        candidates = []
+        
+        async def fetch_and_collect(feed_source):
+            # 解析完立即轉換為候選，不保留整份 Feed
+            feed = await self._fetch_feed_async(session, feed_source, category)
+            return self._collect(feed_source, feed, per_feed_limit)
         
-        # 按日期排序並取最新的一篇
-        if recent_entries:
-            sorted_entries = sorted(recent_entries, 
-                                   key=lambda x: x['published'], 
-                                   reverse=True)
-            return sorted_entries[0]
+        with metrics.span('fetch_candidates_async', category=category, feeds=len(feeds)):
+            results = await asyncio.gather(*(fetch_and_collect(feed_source) for feed_source in feeds))
+            # 依來源順序合併，結果與同步版本一致
+            for feed_candidates in results:
+                candidates.extend(feed_candidates)
         
-        return None
\ No newline at end of file
+        logger.info(f"Collected {len(candidates)} {category} candidates")
+        return candidates
@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# 以 __slots__ 宣告欄位，每個實例不再帶有 __dict__，比同樣內容的 dict 小得多。
+# 部署環境為 Python 3.9，尚不支援 dataclass(slots=True)，因此欄位不設預設值。
+
+
+@dataclass
+class NewsItem:
+    """爬蟲產生、排序後交給摘要器的新聞"""
+    __slots__ = ('title', 'link', 'summary', 'published', 'source', 'weight', 'id')
+
+    title: str
+    link: str
+    summary: str
+    published: str          # 新聞時區的 ISO 8601 字串
+    source: str             # 來源名稱 (news_sources.json 中的 name)
+    weight: float           # 來源權重
+    id: Optional[str]       # 文章ID (article_scores 文件ID)，尚未排序時為None
+
+
+@dataclass
+class NewsSummary:
+    """摘要器產生、交給 LineMessenger 發送的結果"""
+    __slots__ = ('title', 'summary', 'entities', 'language', 'link', 'source')
+
+    title: str
+    summary: str
+    entities: Dict[str, List[str]]   # 實體類型 -> 名稱列表
+    language: str
+    link: str
+    source: Optional[str]
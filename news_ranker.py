@@ -0,0 +1,271 @@
+import os
+import re
+import math
+import zlib
+import hashlib
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from google.api_core.exceptions import AlreadyExists
+from google.cloud import firestore
+
+from metrics import metrics
+from news_models import NewsItem
+from recency import RecencyTracker
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MinHash 參數：16 個雜湊分成 8 個 band，每個 band 2 列
+NUM_HASHES = 16
+BAND_ROWS = 2
+_PRIME = (1 << 61) - 1
+_HASH_PARAMS = [
+    (int.from_bytes(hashlib.sha1(f"a{i}".encode()).digest()[:8], 'big') % _PRIME | 1,
+     int.from_bytes(hashlib.sha1(f"b{i}".encode()).digest()[:8], 'big') % _PRIME)
+    for i in range(NUM_HASHES)
+]
+# 沒有任何 shingle 的文字 (例如單字標題) 的簽章，不可用來判斷相似
+_EMPTY_SIGNATURE = [0] * NUM_HASHES
+
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[a-z0-9]+')
+_HTML_TAG = re.compile(r'<[^>]+>')
+
+SIMILARITY_THRESHOLD = 0.3   # 視為同一則新聞的 Jaccard 相似度
+COVERAGE_BOOST = 0.5         # 每多一個來源報導，分數增加的比例
+SUMMARY_LIMIT = 1000         # 分數紀錄中保存的摘要長度上限
+
+
+def article_id(link):
+    """以連結產生穩定的文章ID"""
+    return hashlib.sha1(link.encode('utf-8')).hexdigest()[:20]
+
+
+class NewsRanker:
+    """在爬取與摘要之間，依時效、來源權重、跨來源報導數及用戶回饋排序候選文章
+
+    每篇文章的 MinHash 簽章只在第一次出現時計算，並以精簡的分數紀錄保存在
+    Firestore 的 `article_scores` 集合，之後的執行只需讀取紀錄並重新計算時效衰減。
+    保存的紀錄同樣只在發布日期為今天或昨天時列入排序。
+    """
+
+    def __init__(self, db=None, half_life_hours=None, reaction_ttl=None, recency=None):
+        self.db = db
+        self.recency = recency or RecencyTracker()
+        if half_life_hours is None:
+            half_life_hours = float(os.environ.get('RANKING_HALF_LIFE_HOURS', '6'))
+        self.half_life_hours = half_life_hours
+        # 回饋次數由多個實例共同累加，快取一段時間後重新讀取
+        if reaction_ttl is None:
+            reaction_ttl = float(os.environ.get('REACTION_CACHE_TTL', '300'))
+        self.reaction_ttl = reaction_ttl
+        self._reactions = None
+        self._reactions_loaded_at = 0.0
+
+    def shingles(self, text):
+        """中文以相鄰兩字、英文以相鄰兩詞作為 shingle"""
+        text = text.lower()
+        result = set()
+        for run in _CJK_RUN.findall(text):
+            result.update(run[i:i + 2] for i in range(len(run) - 1))
+        words = _WORD.findall(text)
+        result.update(f"{words[i]} {words[i + 1]}" for i in range(len(words) - 1))
+        return result
+
+    def signature(self, text):
+        """計算 MinHash 簽章"""
+        hashed = [zlib.crc32(s.encode('utf-8')) for s in self.shingles(text)]
+        if not hashed:
+            return list(_EMPTY_SIGNATURE)
+        return [min((a * h + b) % _PRIME for h in hashed) for a, b in _HASH_PARAMS]
+
+    def _coverage(self, records):
+        """以 LSH 分桶找出相似文章，計算每篇文章被多少個其他來源報導"""
+        buckets = {}
+        for index, record in enumerate(records):
+            signature = record['signature']
+            if signature == _EMPTY_SIGNATURE:
+                continue
+            for band in range(0, NUM_HASHES, BAND_ROWS):
+                key = (band, tuple(signature[band:band + BAND_ROWS]))
+                buckets.setdefault(key, []).append(index)
+
+        other_feeds = [set() for _ in records]
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for i in members:
+                for j in members:
+                    if records[i]['feed'] == records[j]['feed'] or records[j]['feed'] in other_feeds[i]:
+                        continue
+                    si, sj = records[i]['signature'], records[j]['signature']
+                    similarity = sum(1 for x, y in zip(si, sj) if x == y) / NUM_HASHES
+                    if similarity >= SIMILARITY_THRESHOLD:
+                        other_feeds[i].add(records[j]['feed'])
+        return [len(feeds) for feeds in other_feeds]
+
+    def _load_reactions(self):
+        """讀取各來源的用戶回饋 (讚 / 不喜歡 次數)，快取超過 reaction_ttl 秒後重新讀取"""
+        if self._reactions is None or time.monotonic() - self._reactions_loaded_at > self.reaction_ttl:
+            self._reactions = {}
+            self._reactions_loaded_at = time.monotonic()
+            if self.db is not None:
+                try:
+                    for doc in self.db.collection('feed_reactions').stream():
+                        self._reactions[doc.id] = doc.to_dict()
+                except Exception as e:
+                    logger.warning(f"Failed to load feed reactions: {str(e)}")
+        return self._reactions
+
+    def reaction_factor(self, feed):
+        """以拉普拉斯平滑計算回饋係數 (0.5 ~ 1.5，沒有回饋時為 1)"""
+        counts = self._load_reactions().get(feed, {})
+        positive = counts.get('positive', 0)
+        negative = counts.get('negative', 0)
+        return 0.5 + (positive + 1) / (positive + negative + 2)
+
+    def record_reaction(self, feed, positive, user_id=None, news_id=None):
+        """記錄用戶對某來源文章的回饋，同一用戶對同一則新聞只計一次；返回是否有計入"""
+        if not feed:
+            return False
+        key = 'positive' if positive else 'negative'
+        if self.db is None:
+            counts = self._load_reactions().setdefault(feed, {})
+            counts[key] = counts.get(key, 0) + 1
+            return True
+
+        if user_id and news_id:
+            # create() 在文件已存在時失敗，可在多個實例間原子地去除重複回饋
+            now = datetime.now(timezone.utc)
+            try:
+                self.db.collection('reaction_votes').document(f"{news_id}_{user_id}").create({
+                    'feed': feed,
+                    'positive': positive,
+                    'created_at': now,
+                    'expire_at': now + timedelta(days=7),
+                })
+            except AlreadyExists:
+                logger.info(f"User {user_id} already reacted to {news_id}")
+                return False
+
+        # 以 Increment 累加，不會覆寫其他實例寫入的次數
+        self.db.collection('feed_reactions').document(feed).set({key: firestore.Increment(1)}, merge=True)
+        self._reactions = None
+        return True
+
+    def _load_records(self, category, now):
+        """讀取未過期的分數紀錄，返回 (尚未發送的紀錄, 已發送的文章ID)"""
+        if self.db is None:
+            return {}, set()
+        records = {}
+        sent_ids = set()
+        query = self.db.collection('article_scores').where('category', '==', category)
+        with metrics.span('firestore.load_scores', category=category):
+            for doc in query.stream():
+                record = doc.to_dict()
+                if record['expire_at'] <= now:
+                    continue
+                if record['sent']:
+                    sent_ids.add(doc.id)
+                else:
+                    records[doc.id] = record
+        return records, sent_ids
+
+    def _new_record(self, item, category, now):
+        """建立精簡的分數紀錄 (不含全文)"""
+        # 移除HTML標籤後再截斷，避免保存不完整的標籤
+        summary = re.sub(r'\s+', ' ', _HTML_TAG.sub(' ', item.summary)).strip()[:SUMMARY_LIMIT]
+        return {
+            'category': category,
+            'feed': item.source,
+            'weight': item.weight,
+            'title': item.title,
+            'link': item.link,
+            'summary': summary,
+            'published': item.published,
+            'signature': self.signature(f"{item.title} {summary}"),
+            'sent': False,
+            'expire_at': now + timedelta(days=2),
+        }
+
+    def rank(self, candidates, category):
+        """合併新候選與既有紀錄並依分數排序，返回 [(分數, 紀錄)]"""
+        now = datetime.now(timezone.utc)
+        with metrics.span('rank', category=category, candidates=len(candidates)):
+            records, sent_ids = self._load_records(category, now)
+
+            # 只為第一次出現的文章計算簽章並保存；已發送的文章再次出現 (例如高水位尚未推進) 時不再列入
+            new_records = {}
+            for item in candidates:
+                doc_id = article_id(item.link)
+                if doc_id not in records and doc_id not in sent_ids:
+                    new_records[doc_id] = self._new_record(item, category, now)
+            records.update(new_records)
+            self._save_records(new_records)
+
+            # 紀錄最多保存兩天，超過「今天或昨天」的文章不再挑選
+            records = {doc_id: record for doc_id, record in records.items()
+                       if self.recency.is_recent(datetime.fromisoformat(record['published']), now)}
+            if not records:
+                return []
+
+            ids = list(records)
+            ordered = [records[doc_id] for doc_id in ids]
+            coverage = self._coverage(ordered)
+
+            scored = []
+            for doc_id, record, other_feeds in zip(ids, ordered, coverage):
+                published = datetime.fromisoformat(record['published'])
+                age_hours = max(0.0, (now - published).total_seconds() / 3600)
+                recency = math.pow(0.5, age_hours / self.half_life_hours)
+                score = (record['weight'] * recency * (1 + COVERAGE_BOOST * other_feeds)
+                         * self.reaction_factor(record['feed']))
+                scored.append((score, dict(record, id=doc_id)))
+
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        logger.info(f"Ranked {len(scored)} {category} articles ({len(new_records)} new)")
+        return scored
+
+    def select(self, candidates, category):
+        """返回分數最高的文章 (NewsItem)，沒有候選時返回None"""
+        ranked = self.rank(candidates, category)
+        if not ranked:
+            return None
+        score, record = ranked[0]
+        logger.info(f"Selected '{record['title'][:50]}' from {record['feed']} (score {score:.3f})")
+        return NewsItem(
+            title=record['title'],
+            link=record['link'],
+            summary=record['summary'],
+            published=record['published'],
+            source=record['feed'],
+            weight=record['weight'],
+            id=record['id']
+        )
+
+    def mark_sent(self, doc_id):
+        """標記文章已發送，之後不再列入候選"""
+        if self.db is None or not doc_id:
+            return
+        try:
+            self.db.collection('article_scores').document(doc_id).update({'sent': True})
+        except Exception as e:
+            logger.warning(f"Failed to mark article as sent: {str(e)}")
+
+    def _save_records(self, records):
+        if self.db is None or not records:
+            return
+        try:
+            with metrics.span('firestore.save_scores', count=len(records)):
+                items = list(records.items())
+                # Firestore 單一批次最多 500 筆寫入
+                for start in range(0, len(items), 400):
+                    batch = self.db.batch()
+                    for doc_id, record in items[start:start + 400]:
+                        batch.set(self.db.collection('article_scores').document(doc_id), record)
+                    batch.commit()
+        except Exception as e:
+            logger.warning(f"Failed to save article scores: {str(e)}")
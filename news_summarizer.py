@@ -4,6 +4,12 @@ import os
 import html
 import re
 import json
+import asyncio
+
+from token_budget import TokenBudget
+from metrics import metrics
+from news_models import NewsSummary
+from async_io import runtime
 
 class NewsSummarizer:
     def __init__(self):
@@ -20,6 +26,9 @@ class NewsSummarizer:
         else:
             self.gemini_model = None
             print("Warning: GEMINI_API_KEY not found. Falling back to Google NL API for summarization.")
+
+        # 控制送入 Gemini 的輸入 token 數量
+        self.token_budget = TokenBudget()
     
     def clean_html(self, text):
         """清理HTML標籤和字符實體"""
@@ -36,7 +45,7 @@ class NewsSummarizer:
         try:
             # 根據語言選擇適當的提示詞
             if language_code.startswith('zh') or any('\u4e00' <= char <= '\u9fff' for char in text[:100]):
-                prompt = f"""
+                template = """
                 請幫我將以下新聞內容生成一個簡潔、流暢的中文摘要，長度約300字以內。
                 摘要必須是繁體中文，不要使用英文。
                 保留最重要的事實和細節，但不要添加原文中沒有的信息。
@@ -47,7 +56,7 @@ class NewsSummarizer:
                 請直接給出摘要，不要加入額外的說明或引言。
                 """
             else:
-                prompt = f"""
+                template = """
                 Please create a concise and coherent summary of the following news article, 
                 in about 400 characters. Retain the most important facts and details,
                 but don't add information not present in the original text.
@@ -58,6 +67,9 @@ class NewsSummarizer:
                 Provide the summary directly without additional explanations or introductions.
                 """
             
+            # 依預算裁切輸入並壓縮提示詞
+            prompt = self.token_budget.build_prompt(template, text, 'summary')
+
             # 呼叫 Gemini API
             print(f"發送請求到 Gemini API，提示詞長度: {len(prompt)}")
             response = self.gemini_model.generate_content(prompt)
@@ -79,7 +91,7 @@ class NewsSummarizer:
         try:
             # 根據語言選擇適當的提示詞
             if language_code.startswith('zh'):
-                prompt = f"""
+                template = """
                 請從以下新聞內容中提取重要的實體，並按以下類別分類：
                 人物 (PERSON)、組織 (ORGANIZATION)、地點 (LOCATION)、事件 (EVENT)、藝術作品/產品 (WORK_OF_ART)、
                 消費品 (CONSUMER_GOOD) 和其他重要關鍵詞 (OTHER)。
@@ -90,16 +102,16 @@ class NewsSummarizer:
                 {text}
                 
                 請以JSON格式輸出，格式如下：
-                {{
+                {
                   "PERSON": ["人名1", "人名2"],
                   "ORGANIZATION": ["組織1", "組織2"],
                   ...
-                }}
+                }
                 
                 僅返回JSON格式的結果，不要有其他文字。
                 """
             else:
-                prompt = f"""
+                template = """
                 Extract important entities from the following news content and categorize them by:
                 PERSON, ORGANIZATION, LOCATION, EVENT, WORK_OF_ART, CONSUMER_GOOD, and OTHER important keywords.
                 
@@ -109,15 +121,18 @@ class NewsSummarizer:
                 {text}
                 
                 Output in JSON format like:
-                {{
+                {
                   "PERSON": ["name1", "name2"],
                   "ORGANIZATION": ["org1", "org2"],
                   ...
-                }}
+                }
                 
                 Return only the JSON result without any other text.
                 """
             
+            # 依預算裁切輸入並壓縮提示詞
+            prompt = self.token_budget.build_prompt(template, text, 'entities')
+
             # 呼叫 Gemini API
             print("發送實體提取請求到 Gemini API")
             response = self.gemini_model.generate_content(prompt)
@@ -280,117 +295,186 @@ class NewsSummarizer:
             
         return summary
     
+    def _prepare_text(self, news_item):
+        """清理新聞內容並判斷語言，返回 (clean_text, language_code)"""
+        # 清理HTML和格式化文本
+        if news_item.summary:
+            clean_text = self.clean_html(news_item.summary)
+            print(f"使用新聞摘要進行處理，長度: {len(clean_text)}")
+        else:
+            clean_text = news_item.title  # 如果沒有摘要，使用標題
+            print(f"使用新聞標題進行處理: {clean_text}")
+
+        # 更準確的語言檢測邏輯
+        # 首先檢查文本中是否有中文字符
+        has_chinese = any('\u4e00' <= char <= '\u9fff' for char in news_item.title + (news_item.summary or ''))
+
+        if has_chinese:
+            language_code = 'zh'
+            print("檢測到中文內容")
+        else:
+            # 如果沒有明顯的中文字符，才使用 Google API 進行語言檢測
+            try:
+                document = language_v1.Document(
+                    content=clean_text,
+                    type_=language_v1.Document.Type.PLAIN_TEXT
+                )
+                with metrics.span('summarizer.detect_language'):
+                    language_response = self.language_client.detect_language(document=document)
+                language_code = language_response.languages[0].language_code
+                print(f"Google API 檢測到語言: {language_code}")
+            except Exception as e:
+                print(f"語言檢測錯誤: {str(e)}")
+                metrics.increment('fallback.language_heuristic')
+                # 如果檢測失敗，根據 ASCII 字符比例猜測語言
+                non_ascii_ratio = sum(1 for char in clean_text if ord(char) > 127) / (len(clean_text) or 1)
+                language_code = 'zh' if non_ascii_ratio > 0.1 else 'en'
+                print(f"語言檢測失敗，根據字符推測語言為: {language_code}")
+        
+        return clean_text, language_code
+    
+    def _generate_summary(self, clean_text, language_code, max_length):
+        """生成摘要，Gemini 失敗或語言不符時使用後備方法"""
+        # 嘗試使用 Gemini API 生成摘要
+        if self.gemini_model:
+            print("使用 Gemini API 生成摘要")
+            with metrics.span('summarizer.gemini_summary', language=language_code):
+                summary = self.summarize_with_gemini(clean_text, language_code, max_length)
+
+            # 如果 Gemini API 失敗，使用後備方法
+            if not summary:
+                print("Gemini API 摘要失敗，使用後備方法")
+                metrics.increment('fallback.summary')
+                with metrics.span('summarizer.fallback_summary'):
+                    summary = self.fallback_generate_summary(clean_text, max_length)
+        else:
+            # 沒有配置 Gemini API，直接使用後備方法
+            print("未配置 Gemini API，使用後備方法生成摘要")
+            with metrics.span('summarizer.fallback_summary'):
+                summary = self.fallback_generate_summary(clean_text, max_length)
+
+        # 檢查摘要是否符合語言要求
+        if language_code.startswith('zh'):
+            # 檢查摘要是否包含足夠的中文字符
+            chinese_char_count = sum(1 for char in summary if '\u4e00' <= char <= '\u9fff')
+            if chinese_char_count < len(summary) * 0.3:  # 如果中文字符不足30%
+                print("摘要語言不符合要求，重新使用後備方法")
+                metrics.increment('fallback.summary_language')
+                with metrics.span('summarizer.fallback_summary'):
+                    summary = self.fallback_generate_summary(clean_text, max_length)
+        
+        return summary
+    
+    def _extract_entities(self, clean_text, language_code):
+        """提取分類後的實體，Gemini 失敗時使用 NL API"""
+        # 提取分類後的實體
+        if self.gemini_model:
+            print("使用 Gemini API 提取實體")
+            with metrics.span('summarizer.gemini_entities', language=language_code):
+                categorized_entities = self.extract_entities_with_gemini(clean_text, language_code)
+
+            # 如果 Gemini API 提取實體失敗，使用後備方法
+            if not categorized_entities:
+                print("Gemini API 實體提取失敗，使用後備方法")
+                metrics.increment('fallback.entities')
+                with metrics.span('summarizer.nl_entities'):
+                    categorized_entities = self.fallback_extract_entities(clean_text, language_code)
+        else:
+            # 沒有配置 Gemini API，直接使用後備方法
+            print("未配置 Gemini API，使用後備方法提取實體")
+            with metrics.span('summarizer.nl_entities'):
+                categorized_entities = self.fallback_extract_entities(clean_text, language_code)
+        
+        return categorized_entities
+    
+    def _build_result(self, news_item, summary, categorized_entities, language_code):
+        # 返回結果
+        result = NewsSummary(
+            title=news_item.title or '無標題',
+            summary=summary,
+            entities=categorized_entities,
+            language=language_code,
+            link=news_item.link or '#',
+            source=news_item.source
+        )
+        print(f"成功生成摘要，長度: {len(summary)}")
+        return result
+    
+    def _error_result(self, news_item, clean_text, language_code):
+        """即使出錯也返回基本信息"""
+        try:
+            return NewsSummary(
+                title=news_item.title or '無標題',
+                summary=clean_text[:200] + '...' if len(clean_text) > 200 else clean_text,
+                entities={},
+                language=language_code or 'zh',
+                link=news_item.link or '#',
+                source=news_item.source
+            )
+        except:
+            # 極端情況下的後備
+            return NewsSummary(
+                title='處理失敗',
+                summary='無法處理此新聞',
+                entities={},
+                language='zh',
+                link='#',
+                source=None
+            )
+    
+    def _validate(self, news_item):
+        """檢查輸入"""
+        if news_item is None:
+            print("Error: news_item is None")
+            return False
+
+        return True
+    
+    @metrics.traced('summarize')
     def summarize(self, news_item):
         """摘要新聞內容，首先嘗試 Gemini API，失敗則回退到原有方法"""
+        clean_text = None
+        language_code = None
         try:
-            # 檢查輸入
-            if not news_item:
-                print("Error: news_item is None")
+            if not self._validate(news_item):
                 return None
 
-            if 'title' not in news_item:
-                print("Error: news_item missing 'title'")
-                return None
-
-            # 清理HTML和格式化文本
-            if 'summary' in news_item and news_item['summary']:
-                clean_text = self.clean_html(news_item['summary'])
-                print(f"使用新聞摘要進行處理，長度: {len(clean_text)}")
-            else:
-                clean_text = news_item['title']  # 如果沒有摘要，使用標題
-                print(f"使用新聞標題進行處理: {clean_text}")
-            
-            # 更準確的語言檢測邏輯
-            # 首先檢查文本中是否有中文字符
-            has_chinese = any('\u4e00' <= char <= '\u9fff' for char in news_item.get('title', '') + (news_item.get('summary', '') or ''))
-            
-            if has_chinese:
-                language_code = 'zh'
-                print("檢測到中文內容")
-            else:
-                # 如果沒有明顯的中文字符，才使用 Google API 進行語言檢測
-                try:
-                    document = language_v1.Document(
-                        content=clean_text,
-                        type_=language_v1.Document.Type.PLAIN_TEXT
-                    )
-                    language_response = self.language_client.detect_language(document=document)
-                    language_code = language_response.languages[0].language_code
-                    print(f"Google API 檢測到語言: {language_code}")
-                except Exception as e:
-                    print(f"語言檢測錯誤: {str(e)}")
-                    # 如果檢測失敗，根據 ASCII 字符比例猜測語言
-                    non_ascii_ratio = sum(1 for char in clean_text if ord(char) > 127) / (len(clean_text) or 1)
-                    language_code = 'zh' if non_ascii_ratio > 0.1 else 'en'
-                    print(f"語言檢測失敗，根據字符推測語言為: {language_code}")
+            clean_text, language_code = self._prepare_text(news_item)
             
             # 調整摘要長度
             max_length = 300 if language_code.startswith('zh') else 400
             
-            # 嘗試使用 Gemini API 生成摘要
-            if self.gemini_model:
-                print("使用 Gemini API 生成摘要")
-                summary = self.summarize_with_gemini(clean_text, language_code, max_length)
-                
-                # 如果 Gemini API 失敗，使用後備方法
-                if not summary:
-                    print("Gemini API 摘要失敗，使用後備方法")
-                    summary = self.fallback_generate_summary(clean_text, max_length)
-            else:
-                # 沒有配置 Gemini API，直接使用後備方法
-                print("未配置 Gemini API，使用後備方法生成摘要")
-                summary = self.fallback_generate_summary(clean_text, max_length)
+            summary = self._generate_summary(clean_text, language_code, max_length)
+            categorized_entities = self._extract_entities(clean_text, language_code)
             
-            # 檢查摘要是否符合語言要求
-            if language_code.startswith('zh'):
-                # 檢查摘要是否包含足夠的中文字符
-                chinese_char_count = sum(1 for char in summary if '\u4e00' <= char <= '\u9fff')
-                if chinese_char_count < len(summary) * 0.3:  # 如果中文字符不足30%
-                    print("摘要語言不符合要求，重新使用後備方法")
-                    summary = self.fallback_generate_summary(clean_text, max_length)
+            return self._build_result(news_item, summary, categorized_entities, language_code)
             
-            # 提取分類後的實體
-            if self.gemini_model:
-                print("使用 Gemini API 提取實體")
-                categorized_entities = self.extract_entities_with_gemini(clean_text, language_code)
+        except Exception as e:
+            print(f"摘要生成過程中出錯: {str(e)}")
+            return self._error_result(news_item, clean_text, language_code)
+    
+    async def summarize_async(self, news_item):
+        """summarize 的非同步版本：摘要與實體提取兩個模型呼叫同時進行"""
+        if not runtime.enabled:
+            return await asyncio.to_thread(self.summarize, news_item)
+        
+        clean_text = None
+        language_code = None
+        try:
+            if not self._validate(news_item):
+                return None
+
+            with metrics.span('summarize_async'):
+                clean_text, language_code = await asyncio.to_thread(self._prepare_text, news_item)
+                max_length = 300 if language_code.startswith('zh') else 400
                 
-                # 如果 Gemini API 提取實體失敗，使用後備方法
-                if not categorized_entities:
-                    print("Gemini API 實體提取失敗，使用後備方法")
-                    categorized_entities = self.fallback_extract_entities(clean_text, language_code)
-            else:
-                # 沒有配置 Gemini API，直接使用後備方法
-                print("未配置 Gemini API，使用後備方法提取實體")
-                categorized_entities = self.fallback_extract_entities(clean_text, language_code)
-            
-            # 返回結果
-            result = {
-                'title': news_item.get('title', '無標題'),
-                'summary': summary,
-                'entities': categorized_entities,
-                'language': language_code,
-                'link': news_item.get('link', '#')
-            }
-            print(f"成功生成摘要，長度: {len(summary)}")
-            return result
+                summary, categorized_entities = await asyncio.gather(
+                    asyncio.to_thread(self._generate_summary, clean_text, language_code, max_length),
+                    asyncio.to_thread(self._extract_entities, clean_text, language_code)
+                )
             
+            return self._build_result(news_item, summary, categorized_entities, language_code)
+        
         except Exception as e:
             print(f"摘要生成過程中出錯: {str(e)}")
-            # 即使出錯也返回基本信息
-            try:
-                return {
-                    'title': news_item.get('title', '無標題'),
-                    'summary': clean_text[:200] + '...' if len(clean_text) > 200 else clean_text,
-                    'entities': {},
-                    'language': language_code if 'language_code' in locals() else 'zh',
-                    'link': news_item.get('link', '#')
-                }
-            except:
-                # 極端情況下的後備
-                return {
-                    'title': '處理失敗',
-                    'summary': '無法處理此新聞',
-                    'entities': {},
-                    'language': 'zh',
-                    'link': '#'
-                }
\ No newline at end of file
+            return self._error_result(news_item, clean_text, language_code)
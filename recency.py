@@ -0,0 +1,105 @@
+import os
+import calendar
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RecencyTracker:
+    """時區正確的新聞時效判斷，並記錄每個來源已處理到的最新發布時間 (high-water mark)
+
+    high-water mark 與 HTTP 驗證標頭 (ETag / Last-Modified) 由呼叫端先暫存，
+    等新聞成功發送後呼叫 commit() 才寫入 Firestore 的 `feed_state` 集合，
+    避免發送失敗時漏掉文章。
+    """
+
+    def __init__(self, db=None, tz_name=None, max_age_days=1, max_future_hours=None):
+        self.db = db
+        self.tz = ZoneInfo(tz_name or os.environ.get('NEWS_TIMEZONE', 'Asia/Taipei'))
+        self.max_age_days = max_age_days
+        # 發布時間允許超前目前時間的上限 (來源時區標錯時常見)，超過視為排程文章不處理
+        if max_future_hours is None:
+            max_future_hours = float(os.environ.get('NEWS_MAX_FUTURE_HOURS', '24'))
+        self.max_future = timedelta(hours=max_future_hours)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def now(self):
+        """目前時間 (新聞時區的 aware datetime)"""
+        return datetime.now(self.tz)
+
+    def entry_timestamp(self, entry):
+        """取得文章的發布時間 (UTC aware datetime)，沒有日期資訊時返回None"""
+        parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+        if not parsed:
+            return None
+        # feedparser 的 *_parsed 一律為 UTC 的 struct_time
+        return datetime.fromtimestamp(calendar.timegm(parsed), tz=timezone.utc)
+
+    def is_recent(self, timestamp, now=None):
+        """以新聞時區的日期判斷是否為今天或昨天的文章 (超前太多的發布時間不算)"""
+        now = now or self.now()
+        if timestamp > now + self.max_future:
+            return False
+        today = now.astimezone(self.tz).date()
+        return (today - timestamp.astimezone(self.tz).date()).days <= self.max_age_days
+
+    def clamp(self, timestamp, now=None):
+        """超前目前時間的發布時間以目前時間計，高水位不會跑到未來而擋住之後的文章"""
+        now = now or self.now()
+        return min(timestamp, now)
+
+    def _state(self, feed_name):
+        """讀取來源狀態 (每個實例只讀一次Firestore)"""
+        with self._lock:
+            if feed_name in self._states:
+                return self._states[feed_name]
+
+        state = {}
+        if self.db is not None:
+            try:
+                doc = self.db.collection('feed_state').document(feed_name).get()
+                if doc.exists:
+                    state = doc.to_dict()
+            except Exception as e:
+                logger.warning(f"Failed to load feed state for {feed_name}: {str(e)}")
+
+        with self._lock:
+            self._states.setdefault(feed_name, state)
+            return self._states[feed_name]
+
+    def watermark(self, feed_name):
+        """已處理過的最新發布時間，尚無紀錄時返回None (先前存入的未來時間以目前時間計)"""
+        value = self._state(feed_name).get('high_water_mark')
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return self.clamp(value)
+
+    def validators(self, feed_name):
+        """上次成功處理時的 ETag 與 Last-Modified"""
+        state = self._state(feed_name)
+        return state.get('etag'), state.get('modified')
+
+    def commit(self, pending):
+        """套用並保存狀態更新，pending 的格式為 {來源名稱: {欄位: 值}}"""
+        for feed_name, updates in pending.items():
+            updates = {key: value for key, value in updates.items() if value is not None}
+            if not updates:
+                continue
+            state = self._state(feed_name)
+            with self._lock:
+                state.update(updates)
+            if self.db is not None:
+                try:
+                    self.db.collection('feed_state').document(feed_name).set(updates, merge=True)
+                except Exception as e:
+                    logger.warning(f"Failed to save feed state for {feed_name}: {str(e)}")
+        if pending:
+            logger.info(f"Committed feed state for {', '.join(pending)}")
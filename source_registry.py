@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging
+import threading
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'news_sources.json')
+
+# 健康度參數
+LATENCY_TARGET = 2.0        # 秒，超過此延遲的來源健康分數會明顯下降
+EWMA_ALPHA = 0.3            # 指數移動平均的權重
+FAILURE_THRESHOLD = 3       # 連續失敗次數達到此值即暫時跳過
+COOLDOWN_SECONDS = 30 * 60  # 跳過的冷卻時間
+SLOW_LATENCY = float(os.environ.get('FEED_SLOW_LATENCY', '5'))  # 秒，持續超過此延遲的來源暫時跳過
+
+
+class FeedSource:
+    """單一 RSS 來源及其健康狀態"""
+
+    def __init__(self, name, url, weight=1.0, health=None):
+        self.name = name
+        self.url = url
+        self.weight = float(weight)
+        self.load_health(health or {})
+
+    def load_health(self, health):
+        """載入已保存的健康狀態"""
+        self.ewma_latency = health.get('ewma_latency', 0.0)
+        self.success_rate = health.get('success_rate', 1.0)
+        self.consecutive_failures = health.get('consecutive_failures', 0)
+        self.last_failure_at = health.get('last_failure_at', 0.0)
+        self.last_slow_at = health.get('last_slow_at', 0.0)
+
+    @property
+    def health_score(self):
+        """成功率越高、延遲越低，分數越高 (0~1)"""
+        return self.success_rate / (1 + self.ewma_latency / LATENCY_TARGET)
+
+    @property
+    def priority(self):
+        return self.weight * self.health_score
+
+    def is_available(self, now=None):
+        """連續失敗過多或持續過慢，且仍在冷卻期內的來源暫不使用"""
+        now = now if now is not None else time.time()
+        if self.last_slow_at and now - self.last_slow_at < COOLDOWN_SECONDS:
+            return False
+        if self.consecutive_failures < FAILURE_THRESHOLD:
+            return True
+        return now - self.last_failure_at >= COOLDOWN_SECONDS
+
+    def record(self, success, latency):
+        """更新延遲與成功率的移動平均"""
+        self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        self.success_rate = EWMA_ALPHA * (1.0 if success else 0.0) + (1 - EWMA_ALPHA) * self.success_rate
+        if success:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.last_failure_at = time.time()
+        # 平均延遲與本次延遲都超過門檻才進入冷卻，單次延遲突增不算；
+        # 冷卻結束後只要一次抓取夠快就恢復
+        if latency > SLOW_LATENCY and self.ewma_latency > SLOW_LATENCY:
+            self.last_slow_at = time.time()
+        else:
+            self.last_slow_at = 0.0
+
+    def health_dict(self):
+        return {
+            'ewma_latency': self.ewma_latency,
+            'success_rate': self.success_rate,
+            'consecutive_failures': self.consecutive_failures,
+            'last_failure_at': self.last_failure_at,
+            'last_slow_at': self.last_slow_at,
+        }
+
+
+class SourceRegistry:
+    """新聞來源註冊表，支援任意類別及每個類別多個加權來源
+
+    來源設定依序從以下位置載入：
+    1. SOURCE_REGISTRY=firestore 時讀取 Firestore 的 `sources` 集合 (文件ID為類別)
+    2. NEWS_SOURCES_PATH 指定的 JSON 檔 (預設為 news_sources.json)
+    """
+
+    def __init__(self, config=None, db=None):
+        self.db = db
+        self._lock = threading.Lock()
+        if config is None:
+            config = self._load_config()
+        self.categories = {}
+        self.labels = {}
+        # 來源名稱是 feed_health 與 feed_state 的文件ID，跨類別也必須唯一，
+        # 否則兩個類別會共用同一個高水位與 ETag
+        owners = {}
+        for category, spec in config.items():
+            self.labels[category] = spec.get('label', category)
+            self.categories[category] = []
+            for feed in spec.get('feeds', []):
+                if feed['name'] in owners:
+                    raise ValueError(f"Duplicate source name '{feed['name']}' in categories "
+                                     f"'{owners[feed['name']]}' and '{category}'")
+                owners[feed['name']] = category
+                self.categories[category].append(FeedSource(feed['name'], feed['url'], feed.get('weight', 1.0)))
+        if self.db is not None:
+            self._load_health()
+
+    def _load_config(self):
+        if os.environ.get('SOURCE_REGISTRY', '').lower() == 'firestore' and self.db is not None:
+            config = {doc.id: doc.to_dict() for doc in self.db.collection('sources').stream()}
+            if config:
+                logger.info(f"Loaded {len(config)} source categories from Firestore")
+                return config
+            logger.warning("No sources found in Firestore, falling back to config file")
+
+        path = os.environ.get('NEWS_SOURCES_PATH', DEFAULT_SOURCES_PATH)
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_health(self):
+        """從Firestore讀取跨實例共享的健康狀態"""
+        feeds = {feed.name: feed for feed in self._all_feeds()}
+        try:
+            for doc in self.db.collection('feed_health').stream():
+                if doc.id in feeds:
+                    feeds[doc.id].load_health(doc.to_dict())
+        except Exception as e:
+            logger.warning(f"Failed to load feed health: {str(e)}")
+
+    def _all_feeds(self):
+        for feeds in self.categories.values():
+            yield from feeds
+
+    def label(self, category):
+        return self.labels.get(category, category)
+
+    def ordered_feeds(self, category):
+        """依權重×健康分數排序，並跳過冷卻中 (連續失敗或過慢) 的來源 (若全部冷卻中則仍全部嘗試)"""
+        if category not in self.categories:
+            raise ValueError(f"Unknown category '{category}'. Available: {', '.join(self.categories)}")
+
+        feeds = sorted(self.categories[category], key=lambda f: f.priority, reverse=True)
+        now = time.time()
+        available = [f for f in feeds if f.is_available(now)]
+        skipped = len(feeds) - len(available)
+        if skipped:
+            logger.info(f"Skipping {skipped} failing or slow {category} source(s)")
+        return available or feeds
+
+    def record(self, feed, success, latency):
+        """記錄一次抓取結果並寫回Firestore"""
+        with self._lock:
+            feed.record(success, latency)
+        if self.db is not None:
+            try:
+                self.db.collection('feed_health').document(feed.name).set(feed.health_dict())
+            except Exception as e:
+                logger.warning(f"Failed to save health for {feed.name}: {str(e)}")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 模組位於專案根目錄，記憶體版 Firestore 替身位於 benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
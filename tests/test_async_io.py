@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from async_io import AsyncRuntime
+from metrics import Metrics
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+@pytest.fixture
+def runtime():
+    runtime = AsyncRuntime(enabled=False)
+    yield runtime
+    runtime.close()
+
+
+def test_run_propagates_caller_context(runtime):
+    async def read_context():
+        in_loop = request_id.get()
+        in_thread = await asyncio.to_thread(request_id.get)
+        return in_loop, in_thread
+
+    token = request_id.set('req-1')
+    try:
+        assert runtime.run(read_context()) == ('req-1', 'req-1')
+    finally:
+        request_id.reset(token)
+    # 每次呼叫使用自己的 context
+    assert runtime.run(read_context()) == (None, None)
+
+
+def test_run_returns_result_and_raises(runtime):
+    async def fail():
+        raise ValueError('boom')
+
+    async def value():
+        return 42
+
+    assert runtime.run(value()) == 42
+    with pytest.raises(ValueError):
+        runtime.run(fail())
+
+
+def test_counters_are_thread_safe():
+    metrics = Metrics(enabled=True)
+    emitted = []
+    metrics._emit = emitted.append
+
+    def work():
+        for _ in range(10000):
+            metrics.increment('fallback.summary')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.flush()
+
+    assert emitted[0]['counters'] == {'fallback.summary': 40000}
+    assert metrics.counters == {}
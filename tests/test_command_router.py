@@ -0,0 +1,86 @@
+import pytest
+
+from command_router import CommandRouter
+
+HELP = ['幫助', 'help', '說明', '指令']
+STATUS = ['狀態', 'status', '訂閱']
+CANCEL = ['取消', 'unsubscribe', '退訂']
+
+
+def legacy_route(message):
+    """原本 handle_message 中依序以 any() 檢查的邏輯"""
+    message_lower = message.lower()
+    if any(keyword in message_lower for keyword in HELP):
+        return 'help'
+    elif any(keyword in message_lower for keyword in STATUS):
+        return 'status'
+    elif any(keyword in message_lower for keyword in CANCEL):
+        return 'cancel'
+    return 'echo'
+
+
+@pytest.fixture
+def router():
+    router = CommandRouter(default_handler='echo')
+    router.add(HELP, 'help')
+    router.add(STATUS, 'status')
+    router.add(CANCEL, 'cancel')
+    return router
+
+
+@pytest.mark.parametrize('message', [
+    '退訂閱',
+    '取消訂閱',
+    '我要退訂',
+    'unsubscribe',
+    'unsubscribe status',
+    '幫助我取消',
+    '狀態',
+    'HELP',
+    '指令說明',
+    '退訂閱幫助',
+    'hello',
+    '',
+])
+def test_matches_legacy_any_chain(router, message):
+    assert router.route(message) == legacy_route(message)
+
+
+def test_overlapping_keyword_keeps_priority(router):
+    # 「退訂閱」同時包含「退訂」與「訂閱」，訂閱 (狀態) 的優先順序較高，不可刪除用戶
+    assert router.route('退訂閱') == 'status'
+
+
+def test_no_keywords_returns_default():
+    assert CommandRouter(default_handler='echo').route('anything') == 'echo'
+
+
+@pytest.fixture
+def reaction_router(router):
+    router.add(['不喜歡', 'dislike', '👎'], 'dislike', exact=True)
+    router.add(['讚', '喜歡', 'like', '👍'], 'like', exact=True)
+    return router
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('讚', 'like'),
+    ('讚！', 'like'),
+    (' Like ', 'like'),
+    ('👍', 'like'),
+    ('喜歡', 'like'),
+    ('不喜歡', 'dislike'),
+    ('dislike', 'dislike'),
+    ('unlikely', 'echo'),
+    ('looks like rain', 'echo'),
+    ('讚嘆', 'echo'),
+    ('我不喜歡下雨', 'echo'),
+    ('like help', 'help'),
+])
+def test_reactions_require_exact_message(reaction_router, message, expected):
+    assert reaction_router.route(message) == expected
+
+
+def test_substring_commands_keep_priority_over_exact(reaction_router):
+    # 「狀態」仍以子字串匹配，與回饋指令不衝突
+    assert reaction_router.route('訂閱狀態') == 'status'
+    assert reaction_router.route('help') == 'help'
@@ -0,0 +1,57 @@
+import pytest
+
+from fakes import FakeFirestore
+from delivery_ledger import DeliveryLedger, DeliveryFinished
+from news_models import NewsSummary
+
+MESSAGE = {'type': 'text', 'text': 'news'}
+
+
+def make_summary():
+    return NewsSummary(title='標題', summary='摘要', entities={}, language='zh',
+                       link='https://example.com/a', source='tech')
+
+
+@pytest.fixture
+def ledger():
+    return DeliveryLedger(FakeFirestore(), chunk_size=2)
+
+
+def test_create_stores_article_id_and_chunks(ledger):
+    delivery = ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1', 'U2', 'U3'], 'a1')
+
+    assert delivery['article_id'] == 'a1'
+    assert delivery['chunk_count'] == 2
+    chunks = ledger.load_chunks('tech_a1')
+    assert [chunk['recipients'] for chunk in chunks] == [['U1', 'U2'], ['U3']]
+
+
+def test_create_returns_in_progress_delivery(ledger):
+    first = ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1'], 'a1')
+    again = ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1', 'U2'], 'a1')
+
+    assert again['chunk_count'] == first['chunk_count'] == 1
+    assert ledger.find_incomplete('tech')['id'] == 'tech_a1'
+
+
+@pytest.mark.parametrize('status', ['complete', 'failed'])
+def test_create_refuses_finished_delivery(ledger, status):
+    ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1'], 'a1')
+    ledger.finish('tech_a1', status)
+
+    with pytest.raises(DeliveryFinished) as excinfo:
+        ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1'], 'a1')
+    assert excinfo.value.status == status
+    assert ledger.find_incomplete('tech') is None
+
+
+def test_retry_keys_are_derived_from_delivery_and_chunk():
+    # 兩個重疊的執行各自建立紀錄時，同一分段必須帶有相同的 retry key
+    first = DeliveryLedger(FakeFirestore(), chunk_size=1)
+    second = DeliveryLedger(FakeFirestore(), chunk_size=1)
+    for ledger in (first, second):
+        ledger.create('tech_a1', 'tech', make_summary(), MESSAGE, ['U1', 'U2'], 'a1')
+
+    keys = [chunk['retry_key'] for chunk in first.load_chunks('tech_a1')]
+    assert keys == [chunk['retry_key'] for chunk in second.load_chunks('tech_a1')]
+    assert len(set(keys)) == 2
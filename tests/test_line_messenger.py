@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeFirestore
+from delivery_ledger import DeliveryLedger, MAX_ATTEMPTS
+from line_messenger import LineMessenger
+from news_models import NewsSummary
+
+
+class RecordingMessenger(LineMessenger):
+    """以回應序列取代 multicast API，並記錄每次呼叫"""
+
+    def __init__(self, db, ledger, responses=None):
+        super().__init__('token', ledger=ledger, db=db)
+        self.responses = list(responses or [])
+        self.calls = []
+
+    def _multicast(self, recipients, message, retry_key=None):
+        self.calls.append((tuple(recipients), retry_key))
+        return self.responses.pop(0) if self.responses else (True, None)
+
+    async def _multicast_async(self, session, recipients, message, retry_key=None):
+        return self._multicast(recipients, message, retry_key)
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore()
+    for i in range(3):
+        db.collection('users').document(f"U{i}").set({'active': True})
+    return db
+
+
+def make_summary():
+    return NewsSummary(title='標題', summary='摘要', entities={}, language='zh',
+                       link='https://example.com/a', source='tech')
+
+
+def test_deliver_complete_saves_record(db):
+    messenger = RecordingMessenger(db, DeliveryLedger(db, chunk_size=2))
+
+    assert messenger.deliver(make_summary(), 'tech', 'tech_a1', article_id='a1') == 'complete'
+    assert [recipients for recipients, _ in messenger.calls] == [('U0', 'U1'), ('U2',)]
+    assert db.collection('deliveries').document('tech_a1').get().to_dict()['status'] == 'complete'
+    assert db.collection('news').document('tech_a1').get().exists
+
+
+def test_time_budget_pauses_and_resume_continues(db):
+    ledger = DeliveryLedger(db, chunk_size=1)
+    messenger = RecordingMessenger(db, ledger)
+    messenger.time_budget = 0
+
+    # 每次執行至少發送一個分段
+    assert messenger.deliver(make_summary(), 'tech', 'tech_a1') == 'partial'
+    assert len(messenger.calls) == 1
+    assert messenger.resume(ledger.find_incomplete('tech')) == 'partial'
+    assert messenger.resume(ledger.find_incomplete('tech')) == 'complete'
+
+    # 每個分段只發送一次，且帶有自己的 retry key
+    assert [recipients for recipients, _ in messenger.calls] == [('U0',), ('U1',), ('U2',)]
+    assert len({key for _, key in messenger.calls}) == 3
+    assert ledger.find_incomplete('tech') is None
+
+
+def test_deadline_counts_from_request_start(db):
+    ledger = DeliveryLedger(db, chunk_size=1)
+    messenger = RecordingMessenger(db, ledger)
+    messenger.time_budget = 60
+    # 請求開始時取得的截止時間已過 (爬取與摘要用完了預算)
+    deadline = messenger.deadline() - 61
+
+    assert messenger.deliver(make_summary(), 'tech', 'tech_a1', deadline=deadline) == 'partial'
+    assert len(messenger.calls) == 1
+
+
+def test_failed_chunk_is_retried_with_same_key(db):
+    ledger = DeliveryLedger(db, chunk_size=3)
+    messenger = RecordingMessenger(db, ledger, responses=[(False, '500 error')])
+
+    assert messenger.deliver(make_summary(), 'tech', 'tech_a1') == 'partial'
+    assert messenger.resume(ledger.find_incomplete('tech')) == 'complete'
+    assert messenger.calls[0][1] == messenger.calls[1][1]
+
+
+def test_gives_up_after_max_attempts(db):
+    ledger = DeliveryLedger(db, chunk_size=3)
+    messenger = RecordingMessenger(db, ledger, responses=[(False, '500 error')] * MAX_ATTEMPTS)
+
+    status = messenger.deliver(make_summary(), 'tech', 'tech_a1')
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert status == 'partial'
+        status = messenger.resume(ledger.find_incomplete('tech'))
+
+    assert status == 'failed'
+    assert ledger.find_incomplete('tech') is None
+    assert not db.collection('news').document('tech_a1').get().exists
+
+
+def test_resume_async_sends_in_waves(db, monkeypatch):
+    import line_messenger
+
+    async def no_session():
+        return None
+
+    monkeypatch.setattr(line_messenger.runtime, 'enabled', True)
+    monkeypatch.setattr(line_messenger.runtime, 'get_session', no_session)
+    ledger = DeliveryLedger(db, chunk_size=1)
+    messenger = RecordingMessenger(db, ledger)
+    messenger.time_budget = 0
+    messenger.concurrency = 2
+
+    # 時間預算用完時每次執行只發送一輪 (最多 concurrency 個分段)
+    assert asyncio.run(messenger.deliver_async(make_summary(), 'tech', 'tech_a1')) == 'partial'
+    assert len(messenger.calls) == 2
+    assert asyncio.run(messenger.resume_async(ledger.find_incomplete('tech'))) == 'complete'
+    assert sorted(recipients for recipients, _ in messenger.calls) == [('U0',), ('U1',), ('U2',)]
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import feedparser
+import pytest
+
+from news_crawler import NewsCrawler
+from recency import RecencyTracker
+from source_registry import SourceRegistry
+
+CONFIG = {
+    'tech': {
+        'label': '科技',
+        'feeds': [
+            {'name': 'alpha', 'url': 'http://example.com/alpha', 'weight': 2.0},
+            {'name': 'beta', 'url': 'http://example.com/beta', 'weight': 1.0},
+        ],
+    },
+}
+
+
+def rss_item(title=None, link=None, published=None):
+    parts = ['<item>']
+    if title is not None:
+        parts.append(f'<title>{title}</title>')
+    if link is not None:
+        parts.append(f'<link>{link}</link>')
+    if published is not None:
+        parts.append(f'<pubDate>{format_datetime(published)}</pubDate>')
+    parts.append('</item>')
+    return ''.join(parts)
+
+
+def make_feed(*items):
+    return feedparser.parse('<?xml version="1.0"?><rss version="2.0"><channel><title>t</title>'
+                            + ''.join(items) + '</channel></rss>')
+
+
+def hours_ago(hours):
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
+
+def make_crawler():
+    return NewsCrawler(registry=SourceRegistry(CONFIG), recency=RecencyTracker())
+
+
+def test_entries_without_title_or_link_are_skipped():
+    crawler = make_crawler()
+    alpha = crawler.registry.categories['tech'][0]
+    feed = make_feed(
+        rss_item(link='http://example.com/no-title', published=hours_ago(1)),
+        rss_item(title='No link', published=hours_ago(1)),
+        rss_item(title='Good', link='http://example.com/good', published=hours_ago(2)),
+    )
+
+    items = crawler._collect(alpha, feed, 50)
+
+    assert [item.title for item in items] == ['Good']
+    assert crawler.pending_state['alpha']['high_water_mark'] is not None
+
+
+def test_failing_feed_only_drops_that_feed(monkeypatch):
+    crawler = make_crawler()
+    feeds = {
+        'alpha': make_feed(rss_item('A', 'http://example.com/a', hours_ago(1))),
+        'beta': make_feed(rss_item('B', 'http://example.com/b', hours_ago(1))),
+    }
+
+    def fetch_feed(feed_source, category):
+        crawler._stage(feed_source.name, etag=f'"{feed_source.name}"')
+        return feeds[feed_source.name]
+
+    original = crawler._new_entries
+
+    def new_entries(feed, source_type):
+        if source_type == 'alpha':
+            raise AttributeError('broken entry')
+        return original(feed, source_type)
+
+    monkeypatch.setattr(crawler, '_fetch_feed', fetch_feed)
+    monkeypatch.setattr(crawler, '_new_entries', new_entries)
+
+    items = crawler.fetch_candidates('tech')
+
+    assert [item.title for item in items] == ['B']
+    # 失敗來源的驗證標頭不保存，下次會重新下載
+    assert 'alpha' not in crawler.pending_state
+    assert crawler.pending_state['beta']['etag'] == '"beta"'
+
+
+def test_undated_entries_are_skipped():
+    crawler = make_crawler()
+    alpha = crawler.registry.categories['tech'][0]
+    feed = make_feed(
+        rss_item('Undated', 'http://example.com/undated'),
+        rss_item('Dated', 'http://example.com/dated', hours_ago(1)),
+    )
+
+    assert [item.title for item in crawler._collect(alpha, feed, 50)] == ['Dated']
+
+
+def test_watermark_filters_processed_entries():
+    crawler = make_crawler()
+    alpha = crawler.registry.categories['tech'][0]
+    crawler.recency.commit({'alpha': {'high_water_mark': hours_ago(2)}})
+    feed = make_feed(
+        rss_item('Old', 'http://example.com/old', hours_ago(3)),
+        rss_item('New', 'http://example.com/new', hours_ago(1)),
+    )
+
+    assert [item.title for item in crawler._collect(alpha, feed, 50)] == ['New']
+
+
+def test_future_entry_does_not_push_watermark_ahead(monkeypatch):
+    crawler = make_crawler()
+    alpha = crawler.registry.categories['tech'][0]
+    first_run = hours_ago(1)
+    monkeypatch.setattr(crawler.recency, 'now', lambda: first_run)
+
+    # 來源把台北時間標成 GMT，發布時間超前 8 小時
+    crawler._collect(alpha, make_feed(rss_item('Ahead', 'http://example.com/ahead', hours_ago(-7))), 50)
+    assert crawler.pending_state['alpha']['high_water_mark'] == first_run
+    crawler.commit()
+
+    # 下一次執行時，上次執行之後發布的文章仍會被處理
+    monkeypatch.undo()
+    items = crawler._collect(alpha, make_feed(rss_item('Fresh', 'http://example.com/fresh', hours_ago(0.5))), 50)
+    assert [item.title for item in items] == ['Fresh']
+
+
+def test_async_fetch_uses_feed_timeout():
+    aiohttp = pytest.importorskip('aiohttp')
+    crawler = make_crawler()
+    crawler.timeout = 3
+    alpha = crawler.registry.categories['tech'][0]
+    requests = []
+
+    class RecordingSession:
+        def get(self, url, **kwargs):
+            requests.append(kwargs)
+            raise aiohttp.ClientError('offline')
+
+    assert asyncio.run(crawler._fetch_feed_async(RecordingSession(), alpha, 'tech')) is None
+    assert requests[0]['timeout'].total == 3
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeFirestore
+from news_models import NewsItem
+from news_ranker import NewsRanker, article_id
+
+
+def make_item(link, title='Chip maker expands factory', hours_ago=1):
+    published = (datetime.now(timezone.utc) - timedelta(hours=hours_ago)).isoformat()
+    return NewsItem(title=title, link=link, summary=title, published=published,
+                    source='tech', weight=1.0, id=None)
+
+
+def test_sent_article_is_not_selected_again():
+    ranker = NewsRanker(FakeFirestore())
+    candidates = [make_item('https://example.com/a')]
+
+    selected = ranker.select(candidates, 'tech')
+    assert selected.id == article_id('https://example.com/a')
+    ranker.mark_sent(selected.id)
+
+    # 高水位尚未推進時同一篇文章會再次成為候選，不可被重新寫成未發送
+    assert ranker.select(candidates, 'tech') is None
+
+
+def test_select_prefers_newer_article():
+    ranker = NewsRanker(FakeFirestore())
+    old = make_item('https://example.com/old', 'Old story about markets', hours_ago=12)
+    new = make_item('https://example.com/new', 'New story about chips', hours_ago=1)
+
+    assert ranker.select([old, new], 'tech').link == new.link
+
+
+def test_reactions_increment_shared_counts():
+    db = FakeFirestore()
+    first, second = NewsRanker(db), NewsRanker(db)
+    first._load_reactions()
+    second._load_reactions()
+
+    # 兩個實例各自記錄，不可互相覆寫
+    assert first.record_reaction('tech', True, user_id='U1', news_id='n1')
+    assert second.record_reaction('tech', True, user_id='U2', news_id='n1')
+    assert second.record_reaction('tech', False, user_id='U3', news_id='n1')
+
+    assert db.collection('feed_reactions').document('tech').get().to_dict() == {'positive': 2, 'negative': 1}
+    assert first.reaction_factor('tech') == second.reaction_factor('tech') == 0.5 + 3 / 5
+
+
+def test_reaction_counts_once_per_user_and_news():
+    db = FakeFirestore()
+    ranker = NewsRanker(db)
+
+    assert ranker.record_reaction('tech', True, user_id='U1', news_id='n1')
+    assert not ranker.record_reaction('tech', True, user_id='U1', news_id='n1')
+    assert not ranker.record_reaction('tech', False, user_id='U1', news_id='n1')
+    assert ranker.record_reaction('tech', True, user_id='U1', news_id='n2')
+
+    assert db.collection('feed_reactions').document('tech').get().to_dict() == {'positive': 2}
+
+
+def test_reaction_cache_expires():
+    db = FakeFirestore()
+    reader = NewsRanker(db, reaction_ttl=0)
+    reader._load_reactions()
+    NewsRanker(db).record_reaction('tech', False, user_id='U1', news_id='n1')
+
+    assert reader.reaction_factor('tech') == 0.5 + 1 / 3
+
+
+def test_stored_record_older_than_yesterday_is_not_selected():
+    db = FakeFirestore()
+    ranker = NewsRanker(db)
+    stale = make_item('https://example.com/stale', 'Stale story about chips', hours_ago=1)
+    ranker.select([stale], 'tech')
+
+    # 未發送的紀錄仍在保存期限內，但發布日期已超過「今天或昨天」
+    published = (datetime.now(timezone.utc) - timedelta(days=3)).isoformat()
+    db.collection('article_scores').document(article_id(stale.link)).set({'published': published}, merge=True)
+
+    assert ranker.select([], 'tech') is None
+
+
+def test_texts_without_shingles_are_not_coverage():
+    ranker = NewsRanker()
+    records = [
+        {'feed': 'alpha', 'signature': ranker.signature('Apple')},
+        {'feed': 'beta', 'signature': ranker.signature('ニュース')},
+        {'feed': 'gamma', 'signature': ranker.signature('Chip maker expands factory')},
+        {'feed': 'delta', 'signature': ranker.signature('Chip maker expands factory')},
+    ]
+
+    assert ranker._coverage(records) == [0, 0, 1, 1]
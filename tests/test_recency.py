@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from recency import RecencyTracker
+
+TAIPEI = ZoneInfo('Asia/Taipei')
+# 台北 08:30 (UTC 前一天 00:30)
+MORNING_RUN = datetime(2026, 10, 19, 8, 30, tzinfo=TAIPEI)
+
+
+def test_morning_run_uses_taipei_dates():
+    tracker = RecencyTracker(tz_name='Asia/Taipei')
+
+    # 台北昨天 00:10，UTC 已是前天
+    assert tracker.is_recent(datetime(2026, 10, 17, 16, 10, tzinfo=timezone.utc), MORNING_RUN)
+    # 台北前天 23:50
+    assert not tracker.is_recent(datetime(2026, 10, 17, 15, 50, tzinfo=timezone.utc), MORNING_RUN)
+    # 台北今天 08:00
+    assert tracker.is_recent(datetime(2026, 10, 19, 0, 0, tzinfo=timezone.utc), MORNING_RUN)
+
+
+def test_far_future_is_not_recent():
+    tracker = RecencyTracker(tz_name='Asia/Taipei', max_future_hours=24)
+
+    assert tracker.is_recent(MORNING_RUN + timedelta(hours=8), MORNING_RUN)
+    assert not tracker.is_recent(MORNING_RUN + timedelta(hours=25), MORNING_RUN)
+
+
+def test_entry_timestamp_without_date():
+    tracker = RecencyTracker()
+
+    assert tracker.entry_timestamp({'title': 'undated'}) is None
+
+
+def test_stored_future_watermark_is_clamped():
+    tracker = RecencyTracker()
+    future = datetime.now(timezone.utc) + timedelta(hours=8)
+    tracker.commit({'alpha': {'high_water_mark': future}})
+
+    assert tracker.watermark('alpha') <= datetime.now(timezone.utc)
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+import source_registry
+from source_registry import FeedSource, SourceRegistry
+
+CONFIG = {
+    'tech': {
+        'label': '科技',
+        'feeds': [
+            {'name': 'fast', 'url': 'http://example.com/fast', 'weight': 1.0},
+            {'name': 'slow', 'url': 'http://example.com/slow', 'weight': 2.0},
+        ],
+    },
+}
+
+
+def slow_latency():
+    return source_registry.SLOW_LATENCY * 3
+
+
+def make_slow(feed, registry=None):
+    for _ in range(10):
+        if registry is None:
+            feed.record(True, slow_latency())
+        else:
+            registry.record(feed, True, slow_latency())
+
+
+def test_failing_feed_is_skipped_during_cooldown():
+    feed = FeedSource('flaky', 'http://example.com')
+    for _ in range(source_registry.FAILURE_THRESHOLD):
+        feed.record(False, 0.1)
+
+    assert not feed.is_available()
+    assert feed.is_available(time.time() + source_registry.COOLDOWN_SECONDS)
+
+
+def test_single_slow_fetch_does_not_skip_feed():
+    feed = FeedSource('spiky', 'http://example.com')
+    feed.record(True, slow_latency())
+
+    assert feed.ewma_latency < source_registry.SLOW_LATENCY
+    assert feed.is_available()
+
+
+def test_slow_feed_is_skipped_until_cooldown_and_fast_probe():
+    feed = FeedSource('slow', 'http://example.com')
+    make_slow(feed)
+
+    assert not feed.is_available()
+    assert feed.is_available(time.time() + source_registry.COOLDOWN_SECONDS)
+
+    # 冷卻後的一次快速抓取即恢復，即使平均延遲仍高
+    feed.record(True, 0.1)
+    assert feed.ewma_latency > source_registry.SLOW_LATENCY
+    assert feed.is_available()
+
+
+def test_slow_state_survives_reload():
+    feed = FeedSource('slow', 'http://example.com')
+    make_slow(feed)
+
+    restored = FeedSource('slow', 'http://example.com', health=feed.health_dict())
+    assert not restored.is_available()
+
+
+def test_ordered_feeds_skips_slow_feed():
+    registry = SourceRegistry(CONFIG)
+    fast, slow = registry.categories['tech']
+    make_slow(slow, registry)
+
+    assert registry.ordered_feeds('tech') == [fast]
+
+
+def test_ordered_feeds_tries_all_when_every_feed_is_cooling_down():
+    registry = SourceRegistry(CONFIG)
+    for feed in registry.categories['tech']:
+        make_slow(feed, registry)
+
+    assert len(registry.ordered_feeds('tech')) == 2
+
+
+def test_unknown_category():
+    with pytest.raises(ValueError):
+        SourceRegistry(CONFIG).ordered_feeds('sports')
+
+
+def test_duplicate_source_names_are_rejected():
+    config = dict(CONFIG, business={'feeds': [{'name': 'fast', 'url': 'http://example.com/fast'}]})
+
+    with pytest.raises(ValueError, match="'fast'"):
+        SourceRegistry(config)
@@ -0,0 +1,65 @@
+from token_budget import TokenBudget
+
+LEAD = 'Revenue rose 3.5% to $1.2 billion in the quarter.'
+ARTICLE = (LEAD + ' Analysts at U.S. banks expected less. '
+           'Shares rose 4.1% in early trading.')
+
+
+def test_split_keeps_decimals_and_abbreviations():
+    assert TokenBudget().split_sentences(ARTICLE) == [
+        LEAD,
+        'Analysts at U.S. banks expected less.',
+        'Shares rose 4.1% in early trading.',
+    ]
+
+
+def test_split_cjk_without_spaces():
+    text = '台積電營收成長3.5%。法人看好後市！股價上漲4.1%？'
+    assert TokenBudget().split_sentences(text) == ['台積電營收成長3.5%。', '法人看好後市！', '股價上漲4.1%？']
+
+
+def test_selected_sentences_are_unchanged():
+    text = ARTICLE + ' More details follow later today.'
+    budget = TokenBudget()
+    selected = budget.select_sentences(text, 35)
+
+    assert selected.startswith(LEAD)
+    for sentence in budget.split_sentences(selected):
+        assert sentence in text
+
+
+def test_lead_sentence_beats_repeated_boilerplate():
+    filler = 'Subscribe to our newsletter for more news.'
+    text = LEAD + ' ' + ' '.join([filler] * 30)
+    budget = TokenBudget()
+    selected = budget.select_sentences(text, budget.estimate_tokens(LEAD) + 5)
+
+    assert selected == LEAD
+
+
+def test_duplicates_are_dropped():
+    filler = 'Subscribe to our newsletter for more news.'
+    text = ' '.join([filler] * 30) + ' ' + ARTICLE
+    selected = TokenBudget().select_sentences(text, 60)
+
+    assert selected.count(filler) == 1
+    assert selected.startswith(filler)
+
+
+def test_cjk_sentences_join_without_spaces():
+    text = '台積電營收成長3.5%。法人看好後市！' + '這是重複的樣板文字。' * 30
+    selected = TokenBudget().select_sentences(text, 30)
+
+    assert selected == '台積電營收成長3.5%。法人看好後市！這是重複的樣板文字。'
+
+
+def test_truncates_lead_when_nothing_fits():
+    budget = TokenBudget()
+    selected = budget.select_sentences(ARTICLE, 5)
+
+    assert LEAD.startswith(selected)
+    assert budget.estimate_tokens(selected) <= 5
+
+
+def test_text_within_budget_is_unchanged():
+    assert TokenBudget().select_sentences(ARTICLE, 1000) == ARTICLE
@@ -0,0 +1,68 @@
+import user_cache
+from user_cache import UserCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(user_cache.time, 'monotonic', clock)
+    return UserCache(**kwargs), clock
+
+
+def test_hit_until_ttl_expires(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl=300, max_size=10)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return {'active': True}
+
+    assert cache.get('U1', loader) == {'active': True}
+    clock.now += 299
+    assert cache.get('U1', loader) == {'active': True}
+    assert len(loads) == 1
+
+    clock.now += 2
+    cache.get('U1', loader)
+    assert len(loads) == 2
+
+
+def test_missing_user_is_cached(monkeypatch):
+    cache, _ = make_cache(monkeypatch, ttl=300, max_size=10)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return None
+
+    assert cache.get('U1', loader) is None
+    assert cache.get('U1', loader) is None
+    assert len(loads) == 1
+
+
+def test_put_replaces_entry(monkeypatch):
+    cache, _ = make_cache(monkeypatch, ttl=300, max_size=10)
+    cache.put('U1', {'active': True})
+    # 取消訂閱後同一實例立即看到新狀態
+    cache.put('U1', None)
+
+    assert cache.get('U1', lambda: {'active': True}) is None
+
+
+def test_least_recently_used_is_evicted(monkeypatch):
+    cache, _ = make_cache(monkeypatch, ttl=300, max_size=2)
+    cache.put('U1', {'n': 1})
+    cache.put('U2', {'n': 2})
+    cache.get('U1', lambda: None)   # U1 變成最近使用
+    cache.put('U3', {'n': 3})
+
+    assert cache.get('U1', lambda: 'reloaded') == {'n': 1}
+    assert cache.get('U3', lambda: 'reloaded') == {'n': 3}
+    assert cache.get('U2', lambda: 'reloaded') == 'reloaded'
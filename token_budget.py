@@ -0,0 +1,149 @@
+import os
+import re
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 中日韓字元範圍 (CJK 統一漢字、擴展A、相容漢字、假名、韓文)
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+# 拉丁字詞 (含數字)
+_WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+# 句子切分：英文句點等需接空白 (避免切開 3.5%、$1.2)，且不切在 U.S. 這類縮寫之後；
+# 中日韓句末標點後不一定有空白，直接切分
+_SENTENCE_PATTERN = re.compile(r'(?<![A-Z]\.[A-Z]\.)(?<=[.!?])\s+|(?<=[。！？])\s*')
+_CJK_TERMINATORS = ('。', '！', '？')
+
+
+class TokenBudget:
+    """估算 token 數量、壓縮提示詞並依預算挑選輸入句子"""
+
+    def __init__(self, input_budget=None):
+        # 每次呼叫模型時允許的輸入 token 上限
+        if input_budget is None:
+            input_budget = int(os.environ.get('GEMINI_INPUT_TOKEN_BUDGET', '800'))
+        self.input_budget = input_budget
+
+    def estimate_tokens(self, text):
+        """估算文字的 token 數量 (CJK 約每字1個token，拉丁字詞約每4字元1個token)"""
+        if not text:
+            return 0
+
+        cjk_count = len(_CJK_PATTERN.findall(text))
+        latin_tokens = 0
+        for word in _WORD_PATTERN.findall(text):
+            latin_tokens += max(1, (len(word) + 3) // 4)
+
+        # 其餘標點和符號，每個約算1個token
+        other_count = sum(1 for char in text
+                          if not char.isspace() and not char.isalnum() and not _CJK_PATTERN.match(char))
+
+        return cjk_count + latin_tokens + other_count
+
+    def compact_prompt(self, prompt):
+        """移除提示詞中的縮排和多餘空行"""
+        lines = [line.strip() for line in prompt.strip().splitlines()]
+        compacted = []
+        for line in lines:
+            # 連續空行只保留一個
+            if not line and compacted and not compacted[-1]:
+                continue
+            compacted.append(line)
+        return '\n'.join(compacted)
+
+    def split_sentences(self, text):
+        """切分句子，去除空白句及重複句 (保留第一次出現的位置)"""
+        sentences = []
+        seen = set()
+        for sentence in _SENTENCE_PATTERN.split(text):
+            sentence = sentence.strip()
+            if sentence and sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+        return sentences
+
+    def join_sentences(self, sentences):
+        """接回句子，中日韓句末標點後不加空白"""
+        parts = []
+        for sentence in sentences:
+            if parts and not parts[-1].endswith(_CJK_TERMINATORS):
+                parts.append(' ')
+            parts.append(sentence)
+        return ''.join(parts)
+
+    def select_sentences(self, text, budget):
+        """依資訊量挑選句子，使總 token 數不超過預算，並保持原始順序
+
+        第一句 (導言) 一定保留；重複的句子只算一次，避免樣板文字靠重複取得高詞頻。
+        """
+        if self.estimate_tokens(text) <= budget:
+            return text
+
+        sentences = self.split_sentences(text)
+        if not sentences:
+            return ''
+
+        # 導言一定保留，放不下時截斷導言
+        used = self.estimate_tokens(sentences[0])
+        if used > budget:
+            return self._truncate_to_budget(sentences[0], budget)
+
+        # 計算詞頻 (中文按字元，英文按空格)
+        word_frequencies = {}
+        sentence_words = []
+        for sentence in sentences:
+            words = sentence.lower().split() if ' ' in sentence else list(sentence)
+            sentence_words.append(words)
+            for word in words:
+                word_frequencies[word] = word_frequencies.get(word, 0) + 1
+
+        max_frequency = max(word_frequencies.values()) if word_frequencies else 1
+
+        # 句子分數 = 平均詞頻 (避免偏好長句) × 位置權重 (導言較重要)
+        scored = []
+        for i, words in enumerate(sentence_words[1:], start=1):
+            if not words:
+                continue
+            density = sum(word_frequencies[w] for w in set(words)) / (max_frequency * len(words))
+            position_weight = 1.0 if i < 3 else 0.8
+            scored.append((density * position_weight, i))
+
+        # 依分數由高到低放入，直到預算用完
+        selected = [0]
+        for _, i in sorted(scored, reverse=True):
+            cost = self.estimate_tokens(sentences[i])
+            if used + cost > budget:
+                continue
+            selected.append(i)
+            used += cost
+
+        return self.join_sentences(sentences[i] for i in sorted(selected))
+
+    def _truncate_to_budget(self, text, budget):
+        """逐字截斷文字直到符合預算"""
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.estimate_tokens(text[:mid]) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+    def build_prompt(self, template, text, label=''):
+        """將文字裁切至預算內並套入提示詞模板，template 需包含 {text}"""
+        template = self.compact_prompt(template)
+        overhead = self.estimate_tokens(template.replace('{text}', ''))
+        text_budget = max(0, self.input_budget - overhead)
+
+        original_tokens = self.estimate_tokens(text)
+        selected_text = self.select_sentences(text, text_budget)
+        prompt = template.replace('{text}', selected_text)
+        prompt_tokens = self.estimate_tokens(prompt)
+
+        usage = prompt_tokens / self.input_budget if self.input_budget else 0
+        logger.info(f"Token budget [{label}]: budget={self.input_budget}, input={original_tokens}, "
+                    f"selected={self.estimate_tokens(selected_text)}, prompt={prompt_tokens}, usage={usage:.0%}")
+        return prompt
+
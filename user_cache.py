@@ -0,0 +1,46 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# 用來區分「未快取」與「已快取為不存在的用戶」
+_MISSING = object()
+
+
+class UserCache:
+    """用戶文件的 TTL + LRU 快取，減少每則訊息的 Firestore 讀取
+
+    快取只存在於單一實例。訂閱或取消訂閱時以 put() 更新處理該訊息的實例，
+    其他實例最多在 TTL (預設 300 秒) 內仍使用舊的訂閱狀態。
+    """
+
+    def __init__(self, ttl=None, max_size=None):
+        if ttl is None:
+            ttl = float(os.environ.get('USER_CACHE_TTL', '300'))
+        if max_size is None:
+            max_size = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, loader):
+        """取得用戶資料 (不存在時為 None)，未命中或過期時呼叫 loader 從資料庫讀取"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        data = loader()
+        self.put(user_id, data)
+        return data
+
+    def put(self, user_id, data):
+        """寫入快取，data 為 None 表示用戶不存在"""
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)